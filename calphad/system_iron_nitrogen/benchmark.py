@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+""" Benchmarks of phase equilibria and diffusion in steel nitriding.
+
+Running this module executes the whole suite, checks accuracy of phase
+equilibria against OpenCalphad (`oc/`) and Thermo-Calc (`tc/`) results
+and compares timings with those stored in `benchmark_baseline.json`
+(updated with `--save`), exiting with an error on inaccurate results
+or timings slower than baseline by more than `--threshold`. Timings
+below `--min-time` in baseline are reported but not compared, as they
+are dominated by noise.
+"""
+from time import perf_counter
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import numpy as np
+import nitriding
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+BASELINE = os.path.join(HERE, 'benchmark_baseline.json')
+
+# Maximum absolute errors against reference software (and relative
+# errors of fitted diffusion parameters).
+TOLERANCE = {'NP': 1.0e-03, 'W': 1.0e-05, 'fit': 1.0e-02}
+
+
+def reference_case(nx=200):
+    """ Reference nitriding case used in `diffusion.ipynb`. """
+    u0 = np.ones(nx) * 0.000100
+    u0[0] = u0[-1] = 0.020000
+    return dict(t_end=60.0, x_end=0.0003, u0=u0, T=lambda t: 943.0)
+
+
+def _best(func, repeat=3):
+    """ Best wall-clock time of `repeat` calls of `func`. """
+    times = []
+
+    for _ in range(repeat):
+        t0 = perf_counter()
+        func()
+        times.append(perf_counter() - t0)
+
+    return min(times)
+
+
+def bench_equilibrate(npoints=100):
+    """ Median latency of single point `equilibrate` calls. """
+    w = np.linspace(1.0e-04, 0.025, npoints)
+    times = []
+
+    for wk in w:
+        t0 = perf_counter()
+        nitriding.equilibrate(943.0, wk)
+        times.append(perf_counter() - t0)
+
+    return float(np.median(times))
+
+
+def bench_fraction_alpha(sizes=(100, 1000, 10000)):
+    """ Wall-clock of batched `fraction_alpha` over numbers of cells. """
+    results = {}
+
+    for size in sizes:
+        u = np.linspace(1.0e-04, 0.025, size)
+        guess = nitriding.NitridingLayer.fraction_alpha(943.0, u, None)
+        results[size] = _best(lambda: nitriding.NitridingLayer
+                              .fraction_alpha(943.0, u, guess))
+
+    return results
+
+
+def bench_implicit(nt=601):
+    """ Best wall-clock of `solve_implicit` with fixed and adaptive steps.
+
+    Fixed steps are `nt` (finer than default), so that timing is long
+    enough to be compared with baseline.
+    """
+    results = {}
+
+    for name, opts in (('fixed', {'nt': nt}),
+                       ('adaptive', {'adaptive': True})):
+        def run():
+            nitriding.NitridingLayer().solve_implicit(
+                **reference_case(), plot=False, stats=nitriding.RunStats(),
+                **opts)
+
+        # First run builds lazy solvers.
+        run()
+        results[name] = _best(run)
+
+    return results
+
+
+def bench_explicit_methods(methods=('RK23', 'BDF', 'Radau', 'LSODA')):
+    """ Best wall-clock and RHS evaluations of `solve_explicit` methods. """
+    results = {}
+
+    for method in methods:
+        model = nitriding.NitridingLayer()
+
+        def run():
+            model.solve_explicit(**reference_case(), method=method,
+                                 plot=False)
+
+        # First run builds lazy solvers.
+        run()
+        results[method] = dict(time=_best(run), nfev=model.solution.nfev,
+                               njev=model.solution.njev)
+
+    return results
+
+
+def bench_codegen(nsolve=300, nbatch=1000):
+    """ Best construction and solution times with and without codegen. """
+    results = {}
+    w = np.linspace(0.0, 0.03, nbatch)
+
+    for codegen in (False, True):
+        # First call compiles libraries if not cached yet.
+        nitriding.get_batch_calculator(
+            nitriding.get_system_calculator(codegen=codegen), codegen=codegen)
+
+        def build():
+            ce = nitriding.get_system_calculator(codegen=codegen)
+            return ce, nitriding.get_batch_calculator(ce, codegen=codegen)
+
+        t_build = _best(build)
+        ce, ce_batch = build()
+
+        t_solve = _best(lambda: [ce(943.0, 0.004)
+                                 for _ in range(nsolve)]) / nsolve
+        t_batch = _best(lambda: ce_batch(943.0, w))
+
+        results[codegen] = dict(build=t_build, solve=t_solve, batch=t_batch)
+
+    return results
+
+
+def bench_continuation(nt=61, w=(0.001, 0.004, 0.01, 0.02)):
+    """ Ipopt iterations along a heating ramp, cold and warm started. """
+    T = np.linspace(900.0, 960.0, nt)
+    w = np.asarray(w)
+
+    t0 = perf_counter()
+    cold = sum(nitriding.CE(Tk, wk)[0]['stats']['iter_count']
+               for Tk in T for wk in w)
+    t_cold = perf_counter() - t0
+
+    t0 = perf_counter()
+    _, stats = nitriding.trace_equilibrium(T, w[None, :])
+    t_warm = perf_counter() - t0
+
+    return dict(cold=dict(time=t_cold, iter=cold),
+                warm=dict(time=t_warm, iter=int(stats['iter'].sum())))
+
+
+def bench_properties(npoints=1_000_000, nloop=10_000):
+    """ Throughput [points/s] of point-wise and vectorized properties. """
+    rng = np.random.default_rng(42)
+    T = rng.uniform(800.0, 1100.0, npoints)
+    x = rng.uniform(1.0e-05, 0.1, npoints)
+    results = {}
+
+    f = nitriding.get_property_calculator()._function
+
+    t0 = perf_counter()
+    for k in range(nloop):
+        f(T[k], x[k])
+    results['point'] = nloop / (perf_counter() - t0)
+
+    for codegen in (False, True):
+        properties = nitriding.get_property_calculator(codegen=codegen)
+
+        t0 = perf_counter()
+        properties(T, x)
+        results[f'map codegen = {codegen}'] = \
+            npoints / (perf_counter() - t0)
+
+    return results
+
+
+def bench_import(repeat=5):
+    """ Best wall-clock time of importing `nitriding` in a new process. """
+    code = ("from time import perf_counter; t0 = perf_counter(); "
+            "import nitriding; print(perf_counter() - t0)")
+    cmd = [sys.executable, '-c', code]
+
+    return min(float(subprocess.run(cmd, capture_output=True, check=True,
+                                    text=True).stdout) for _ in range(repeat))
+
+
+def _label(label):
+    """ Quantity (`NP` or `W`) and phase index of curve `label`. """
+    label = label.replace('-', '_').replace('#1', '').upper()
+    phase = 0 if 'BCC_A2' in label else 1
+    return label.split('(')[0], phase
+
+
+def read_oc_plt(fname):
+    """ Curves of OpenCalphad GNUPLOT file as `{label: (w, y)}`. """
+    with open(fname) as fp:
+        lines = fp.read().split('<< EOD')[1].split('EOD')[0].splitlines()
+
+    keys = lines[1].split()[2:]
+    data = np.array([[float(v) for v in line.split()[1:]]
+                     for line in lines if line.strip()[:1].isdigit()])
+
+    return {key: (data[:, 0], data[:, k + 1])
+            for k, key in enumerate(keys)}
+
+
+def read_tc_exp(fname):
+    """ Curves of Thermo-Calc experimental file as `{label: (w, y)}`. """
+    curves, label = {}, None
+
+    with open(fname) as fp:
+        for line in fp:
+            words = line.split()
+
+            if line.startswith('$ PLOTTED COLUMNS'):
+                label = words[-1]
+                curves.setdefault(label, [])
+                continue
+
+            try:
+                point = [float(v) for v in words[:2]]
+            except ValueError:
+                continue
+
+            if label is not None and len(point) == 2 and \
+                    words[2:] in ([], ['M']):
+                curves[label].append(point)
+
+    return {k: tuple(np.array(v).T) for k, v in curves.items()}
+
+
+def check_accuracy(T=943.0):
+    """ Maximum errors of equilibria against reference software.
+
+    Phase fractions `NP` (absent phases are zero) and nitrogen mass
+    fraction `W` in phases (where present) are compared.
+    """
+    references = {
+        'oc': {**read_oc_plt(os.path.join(HERE, 'oc/phase-fraction-oc.plt')),
+               **read_oc_plt(os.path.join(HERE, 'oc/phase-nitrogen-oc.plt'))},
+        'tc': {**read_tc_exp(os.path.join(HERE, 'tc/phase-fraction-tc.exp')),
+               **read_tc_exp(os.path.join(HERE, 'tc/phase-nitrogen-tc.exp'))}
+    }
+    errors = {}
+
+    for source, curves in references.items():
+        for label, (w, y) in curves.items():
+            if label == 'W(N)':
+                continue
+
+            kind, phase = _label(label)
+            sol = nitriding.equilibrate_batch(T, w)
+
+            if kind == 'NP':
+                value, y = sol[:, phase], np.nan_to_num(y)
+                present = np.ones_like(y, dtype=bool)
+            else:
+                value = nitriding.mole_to_mass_fraction(sol[:, 2 + phase])
+                present = np.isfinite(y) & (sol[:, phase] > 0)
+
+            errors[f'{source}/{label}'] = dict(
+                error=float(np.max(np.abs(value - y)[present])),
+                tolerance=TOLERANCE[kind])
+
+    return errors
+
+
+def check_fit(true=None, temperatures=(893.0, 943.0)):
+    """ Relative errors of diffusion parameters fitted with defaults.
+
+    Final profiles simulated with `true` parameters at `temperatures`
+    are fitted by `DiffusivityFit` with default arguments (thus from
+    default parameters), which must recover the `true` ones.
+    """
+    if true is None:
+        true = dict(d0_alpha=6.0e-07, ea_alpha=82000.0)
+
+    experiments = []
+
+    for T in temperatures:
+        u0 = np.ones(100) * 0.000100
+        u0[0] = u0[-1] = 0.020000
+        experiments.append(dict(T=T, u0=u0, t_end=60.0, x_end=0.0003,
+                                depth=np.linspace(5.0e-06, 1.5e-04, 25)))
+
+    with nitriding.DiffusivityFit(experiments, ofreq=np.inf) as fit:
+        for experiment, w in zip(experiments, fit.simulate(true)[0]):
+            experiment['w'] = w
+
+    with nitriding.DiffusivityFit(experiments, ofreq=np.inf) as fit:
+        params = fit.fit().params
+
+    expected = {**nitriding.NitridingLayer.PARAMS, **true}
+
+    return {f'fit/{k}': dict(error=abs(params[k] / expected[k] - 1),
+                             tolerance=TOLERANCE['fit'])
+            for k in expected if k != 'mixture'}
+
+
+def run_suite():
+    """ Timings [s] of all benchmarks as a flat dictionary. """
+    results = {'import': bench_import(),
+               'equilibrate': bench_equilibrate()}
+
+    for size, elapsed in bench_fraction_alpha().items():
+        results[f'fraction_alpha/{size}'] = elapsed
+
+    for name, elapsed in bench_implicit().items():
+        results[f'solve_implicit/{name}'] = elapsed
+
+    for method, res in bench_explicit_methods().items():
+        results[f'solve_explicit/{method}'] = res['time']
+
+    for start, res in bench_continuation().items():
+        results[f'continuation/{start}'] = res['time']
+
+    for mode, rate in bench_properties().items():
+        results[f'properties/{mode}'] = 1 / rate
+
+    for codegen, res in bench_codegen().items():
+        for name, elapsed in res.items():
+            results[f'codegen={codegen}/{name}'] = elapsed
+
+    return results
+
+
+def compare(results, baseline, threshold, min_time=0.0):
+    """ Ratios of timings to baseline exceeding `threshold`.
+
+    Only timings of at least `min_time` in baseline are compared.
+    """
+    return {name: elapsed / baseline[name]
+            for name, elapsed in results.items()
+            if baseline.get(name, 0.0) >= min_time
+            and elapsed > threshold * baseline[name]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--save', action='store_true',
+                        help='store timings as new baseline')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='tolerated slow-down ratio to baseline')
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help='shortest baseline timing [s] to compare')
+    args = parser.parse_args()
+
+    failed = False
+
+    for name, res in {**check_accuracy(), **check_fit()}.items():
+        ok = res['error'] <= res['tolerance']
+        failed |= not ok
+        print(f"accuracy {name:22s} {res['error']:10.3e} "
+              f"{'ok' if ok else 'FAILED'}")
+
+    baseline = {}
+
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as fp:
+            baseline = json.load(fp)['timings']
+
+    results = run_suite()
+    slower = compare(results, baseline, args.threshold, args.min_time)
+
+    for name, elapsed in results.items():
+        ratio = f"{elapsed / baseline[name]:6.2f}x" if name in baseline \
+            else '     -'
+        flag = 'SLOWER' if name in slower else \
+            'not gated' if baseline.get(name, 0.0) < args.min_time else ''
+        print(f"{name:32s} {elapsed:12.6f} s {ratio} {flag}")
+
+    if args.save:
+        with open(BASELINE, 'w') as fp:
+            json.dump({'platform': platform.platform(),
+                       'python': platform.python_version(),
+                       'casadi': nitriding.casadi_version,
+                       'numpy': np.__version__,
+                       'timings': results}, fp, indent=4)
+    else:
+        failed |= bool(slower)
+
+    sys.exit(1 if failed else 0)
@@ -1,28 +1,49 @@
 # -*- coding: utf-8 -*-
 """ Implements phase equilibria and diffusion in steel nitriding.
 
+Heavy dependencies (SciPy solvers, Matplotlib, OpenGen) are imported
+where first needed and equilibrium solvers are only constructed at their
+first call, so that importing this module remains cheap (e.g. in worker
+processes which only need diffusion coefficients).
+
 To-do list
 ==========
 - Implement phase equilibria also using opengen for performance.
 - Replace coefficients of diffusion by those of nitrogen.
 - Full refactoring and clean-up.
 """
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextlib import nullcontext
+from functools import wraps
+from hashlib import sha1
 from io import StringIO
+from itertools import product
+from itertools import repeat
+from time import perf_counter
 from casadi import SX
 from casadi import exp
 from casadi import log as ln
 from casadi import heaviside
+from casadi import if_else
 from casadi import vertcat
 from casadi import dot
+from casadi import gradient
+from casadi import jacobian
+from casadi import reshape
+from casadi import substitute
 from casadi import nlpsol
 from casadi import Function
 from casadi import linspace
-from scipy import sparse
-from scipy import integrate
-from matplotlib import pyplot as plt
+from casadi import external
+from casadi import __version__ as casadi_version
+import json
+import os
+import pickle
+import struct
 import sys
+import threading
 import numpy as np
-import opengen as og
 
 __author__ = "Walter Dal'Maz Silva"
 __version__ = "0.1.0"
@@ -40,8 +61,38 @@ mm_nn = 1.4007E+01
 
 # Symbol for system temperature.
 T = SX.sym('T')
+
+# Load equilibrium problems from compiled (cached) libraries.
+CODEGEN = os.environ.get('NITRIDING_CODEGEN', '0') == '1'
+CODEGEN_DIR = os.environ.get('NITRIDING_CODEGEN_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'codegen'))
     
     
+class _ThreadLocalStream:
+    """ Stream forwarding writes to the current thread buffer, if any. """
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    @property
+    def buffers(self):
+        """ Stack of capture buffers of calling thread. """
+        if not hasattr(self._local, 'buffers'):
+            self._local.buffers = []
+        return self._local.buffers
+
+    def write(self, text):
+        buffers = self.buffers
+        return (buffers[-1] if buffers else self._stream).write(text)
+
+    def flush(self):
+        if not self.buffers:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
 class Capturing(list):
     """ Helper to capture excessive solver output.
 
@@ -49,29 +100,119 @@ class Capturing(list):
     be desirable to capture solver (here Ipopt specifically) output
     to later check, thus avoiding a overly long notebook.  For this
     end this context manager is to be used and redirect to a list.
+
+    On first use `sys.stdout` is replaced by a proxy which forwards
+    writes of a thread to its innermost active capture, so that
+    captures are reentrant and do not mix output of other threads.
     """
+    _lock = threading.Lock()
+
     def __enter__(self):
-        self._stdout = sys.stdout
-        sys.stdout = self._stringio = StringIO()
-        sys.stderr = sys.stdout
+        with Capturing._lock:
+            if not isinstance(sys.stdout, _ThreadLocalStream):
+                sys.stdout = _ThreadLocalStream(sys.stdout)
+
+        self._stream = sys.stdout
+        self._stringio = StringIO()
+        self._stream.buffers.append(self._stringio)
         return self
 
     def __exit__(self, *args):
+        self._stream.buffers.remove(self._stringio)
         self.extend(self._stringio.getvalue().splitlines())
-        del self._stringio
-        sys.stdout = self._stdout
+        del self._stringio, self._stream
         
 
-def gm_magnetic(y_nn, Tc, beta, p, afm):
-    """ Magnetic contribution to Gibbs energy of phase. """
-    # Transform negative values.
-    Tc = Tc if Tc > 0 else Tc / afm
-    beta = beta if beta > 0 else beta / afm
+class RunStats:
+    """ Timers and counters of a simulation run.
+
+    Provided as `stats` to solvers of `NitridingLayer` it is activated
+    (in the calling thread) during the run, accumulating wall-clock
+    time and calls of sections (equilibrium, coefficients, assembly,
+    linear solution, etc.) and counters incremented by equilibrium
+    calculators (Ipopt and Newton iterations, fallbacks, cache hits).
+    Every `every` steps the `callback` is called with `report()`.
+    """
+    _active = threading.local()
+
+    def __init__(self, callback=None, every=10):
+        self._callback = callback
+        self._every = every
+        self.timers = {}
+        self.calls = {}
+        self.counters = {}
+        self.progress_info = {}
+        self._t0 = perf_counter()
 
-    # Composition dependency of magnetic term for FCC only.
-    if afm <= -3:
-        Tc *= (1 - y_nn)
-        beta *= (1 - y_nn)
+    def __enter__(self):
+        self._previous = getattr(RunStats._active, 'stats', None)
+        RunStats._active.stats = self
+        return self
+
+    def __exit__(self, *args):
+        RunStats._active.stats = self._previous
+
+    @staticmethod
+    def count(name, n=1):
+        """ Increment counter `name` of statistics active in thread. """
+        stats = getattr(RunStats._active, 'stats', None)
+
+        if stats is not None:
+            stats.counters[name] = stats.counters.get(name, 0) + int(n)
+
+    @contextmanager
+    def timer(self, name):
+        """ Accumulate time spent in `with` block under `name`. """
+        t0 = perf_counter()
+
+        try:
+            yield
+        finally:
+            self.timers[name] = self.timers.get(name, 0.0) + \
+                perf_counter() - t0
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def progress(self, step, t, dt=None):
+        """ Record progress of run, reporting to callback. """
+        self.progress_info = dict(step=int(step), t=float(t),
+                                  dt=None if dt is None else float(dt))
+
+        if self._callback is not None and not step % self._every:
+            self._callback(self.report())
+
+    def report(self):
+        """ Structured summary of statistics collected so far. """
+        wall = perf_counter() - self._t0
+        hits = self.counters.get('cache_hits', 0)
+        misses = self.counters.get('cache_misses', 0)
+
+        return dict(
+            wall=wall, **self.progress_info,
+            timers={name: dict(time=time, calls=self.calls[name],
+                               share=time / wall)
+                    for name, time in self.timers.items()},
+            counters=dict(self.counters),
+            cache_hit_rate=hits / (hits + misses) if hits + misses else None
+        )
+
+
+def _instrumented(solve):
+    """ Activate run statistics `stats` (if provided) during `solve`. """
+    @wraps(solve)
+    def wrapper(self, *args, **kwargs):
+        self._stats = kwargs.get('stats', None)
+
+        with self._stats or nullcontext():
+            return solve(self, *args, **kwargs)
+
+    return wrapper
+
+
+def gm_magnetic(Tc, beta, p, afm):
+    """ Magnetic contribution to Gibbs energy of phase. """
+    # Transform negative (antiferromagnetic) values.
+    Tc = if_else(Tc > 0, Tc, Tc / afm)
+    beta = if_else(beta > 0, beta, beta / afm)
 
     # Structure parameter.
     A = (518 / 1125) + (11692 / 15975) * (1 / p - 1)
@@ -99,34 +240,42 @@ def gm_magnetic(y_nn, Tc, beta, p, afm):
     return R * T * ln(1 + beta) * f
 
 
-def g_sublaticce(x_nn, g_fe_nn, g_fe_va, l_fe_nn_va, c, Tc, beta, p, afm):
-    """ Sublattice model for BCC and FCC phases. """
-    # Compute site fraction of nitrogen in interstitial sub-lattice.
-    y_nn = (x_nn / (1 - x_nn)) * (1 / c)
+def redlich_kister(y, g_end, l_mix):
+    """ Property of binary mixing with Redlich-Kister interactions. """
+    # Linear interpolation between end-members.
+    g = y * g_end[0] + (1 - y) * g_end[1]
+
+    # Excess terms of increasing order.
+    for k, l_k in enumerate(l_mix):
+        g += y * (1 - y) * l_k * (2 * y - 1)**k
 
-    # Compute site fraction of vacancies with balance.
-    y_va = 1 - y_nn
+    return g
 
-    # Ideal mixing contribution.
-    gmix = y_nn * g_fe_nn + y_va * g_fe_va
+
+def g_sublaticce(y, g_end, l_mix, c, Tc, beta, p, afm):
+    """ Sublattice model for phases with one mixing sublattice.
+
+    Site fraction `y` is that of the first of the two constituents of
+    the mixing sublattice with `c` sites, and `g_end` the Gibbs energy
+    of end-members with each constituent. Interactions `l_mix`, Curie
+    temperature `Tc` and magnetic moment `beta` are Redlich-Kister
+    series; magnetic contribution is skipped if `afm` is `None`.
+    """
+    # Mixing of end-members with excess terms.
+    gmix = redlich_kister(y, g_end, l_mix)
 
     # Entropy terms contribution
-    smix = c * R * T * (y_nn * ln(y_nn) + y_va * ln(y_va))
+    smix = c * R * T * (y * ln(y) + (1 - y) * ln(1 - y))
 
-    # Excess term contribution.
-    lmix = y_nn * y_va * l_fe_nn_va
+    if afm is None:
+        return gmix + smix
 
     # Magnetic term contribution.
-    gmag = gm_magnetic(y_nn, Tc, beta, p, afm)
+    gmag = gm_magnetic(redlich_kister(y, *Tc), redlich_kister(y, *beta),
+                       p, afm)
 
     # Compose molar Gibbs energy.
-    return gmix + smix + lmix + gmag
-
-
-def gparams(a):
-    """ Parameter representation with 6 coefficients. """
-    b = a[1] + a[2] * ln(T) + a[3] * T + a[4] * T**2
-    return a[0] + T * b + a[5] / T
+    return gmix + smix + gmag
 
 
 def mass_to_mole_fraction(w):
@@ -144,6 +293,318 @@ def nitrogen_activity(kn, dg, T):
     return kn * exp(-dg / (R * T))
 
 
+def _parse_expression(expr):
+    """ Terms `(coef, k, m, name)` of `coef * T**k * LN(T)**m * name`. """
+    expr = expr.replace(' ', '').upper().replace('**', '^')
+    terms = []
+    start = depth = 0
+
+    # Split at signs which are not exponents of numbers or powers.
+    for i, char in enumerate(expr):
+        depth += (char == '(') - (char == ')')
+
+        if char not in '+-' or depth or i == start:
+            continue
+
+        if expr[i - 1] == 'E' and i > 1 and expr[i - 2] in '0123456789.':
+            continue
+
+        terms.append(expr[start:i])
+        start = i
+
+    terms.append(expr[start:])
+    parsed = []
+
+    for term in filter(None, terms):
+        coef, k, m, name = -1.0 if term[0] == '-' else 1.0, 0, 0, None
+
+        for factor in term.lstrip('+-').split('*'):
+            if factor == 'T':
+                k += 1
+            elif factor.startswith('T^'):
+                k += int(factor[2:].strip('()'))
+            elif factor == 'LN(T)':
+                m += 1
+            elif factor[0].isalpha() or factor[0] == '_':
+                if name is not None:
+                    raise ValueError(f'Unsupported TDB term: {term}')
+                name = factor
+            else:
+                coef *= float(factor)
+
+        parsed.append((coef, k, m, name))
+
+    return tuple(parsed)
+
+
+def _parse_segments(body):
+    """ Piecewise expression as lower bound and `(T_high, terms)`. """
+    parts = body.split(';')
+    t_low, expr = parts[0].split(None, 1)
+    segments = []
+
+    for part in parts[1:]:
+        words = part.split(None, 2)
+        segments.append((float(words[0]), _parse_expression(expr)))
+
+        if words[1].upper() != 'Y':
+            break
+
+        expr = words[2]
+
+    return float(t_low), tuple(segments)
+
+
+def parse_tdb(text):
+    """ Database dictionary from contents of a TDB file.
+
+    Only commands required to build binary sublattice phases are
+    interpreted (`ELEMENT`, `TYPE_DEFINITION`, `PHASE`, `CONSTITUENT`,
+    `FUNCTION` and `PARAMETER`), others are ignored. Parameters are
+    indexed by `(kind, phase, constituents, order)` with constituents
+    given as a tuple of sorted tuples, one for each sublattice.
+    """
+    db = {'elements': {}, 'phases': {}, 'functions': {}, 'parameters': {}}
+    types = {}
+
+    # Drop comments and split at command terminators.
+    lines = [line for line in text.splitlines()
+             if not line.lstrip().startswith('$')]
+
+    for command in ' '.join(lines).split('!'):
+        words = command.split()
+
+        if not words:
+            continue
+
+        keyword = words[0].upper()
+
+        if 'ELEMENT'.startswith(keyword) and len(words) > 3:
+            db['elements'][words[1].upper()] = float(words[3])
+
+        elif 'TYPE_DEFINITION'.startswith(keyword) and len(keyword) > 1:
+            if 'MAGNETIC' in (w.upper() for w in words):
+                k = [w.upper() for w in words].index('MAGNETIC')
+                types[words[1]] = (float(words[k + 1]), float(words[k + 2]))
+
+        elif 'PHASE'.startswith(keyword) and len(keyword) > 1:
+            name, codes, nsub = words[1].upper(), words[2], int(words[3])
+            magnetic = [types[c] for c in codes if c in types]
+            db['phases'][name] = {
+                'sites': tuple(float(v) for v in words[4:4 + nsub]),
+                'magnetic': magnetic[0] if magnetic else None
+            }
+
+        elif 'CONSTITUENT'.startswith(keyword) and len(keyword) > 1:
+            name, body = command.split(None, 2)[1:]
+            db['phases'][name.upper()]['constituents'] = tuple(
+                tuple(c.strip().upper() for c in sub.split(',')
+                      if c.strip())
+                for sub in body.strip().strip(':').split(':'))
+
+        elif 'FUNCTION'.startswith(keyword) and len(keyword) > 1:
+            name, body = command.split(None, 2)[1:]
+            db['functions'][name.upper()] = _parse_segments(body)
+
+        elif 'PARAMETER'.startswith(keyword) and len(keyword) > 1:
+            head, body = command.split(None, 1)[1].split(')', 1)
+            kind, args = head.split('(')
+            phase, args = args.split(',', 1)
+            constituents, order = args.split(';')
+            key = (kind.strip().upper(), phase.strip().upper(),
+                   tuple(tuple(sorted(c.strip().upper()
+                                      for c in sub.split(',')))
+                         for sub in constituents.split(':')),
+                   int(order))
+            db['parameters'][key] = _parse_segments(body)
+
+    return db
+
+
+_DATABASES = {}
+
+# Version of parsed databases format, to be bumped with `parse_tdb`.
+TDB_PARSER_VERSION = 1
+
+
+def read_tdb(fname):
+    """ Parsed TDB database, cached in memory and (if possible) on disk.
+
+    Parsed databases are stored as pickles in `CODEGEN_DIR` under a
+    name keyed by file contents and `TDB_PARSER_VERSION`, so that worker
+    processes only load the binary form instead of parsing text. If
+    the directory is not writable databases are only kept in memory.
+    """
+    with open(fname, 'rb') as fp:
+        text = fp.read()
+
+    version = str(TDB_PARSER_VERSION).encode()
+    key = sha1(text + version).hexdigest()[:12]
+
+    if key in _DATABASES:
+        return _DATABASES[key]
+
+    name = os.path.splitext(os.path.basename(fname))[0]
+    cache = os.path.join(CODEGEN_DIR, f'{name}_{key}.pickle')
+
+    if os.path.exists(cache):
+        with open(cache, 'rb') as fp:
+            db = pickle.load(fp)
+    else:
+        db = parse_tdb(text.decode('utf-8', errors='replace'))
+        tmp = f'{cache}.{os.getpid()}'
+
+        try:
+            os.makedirs(CODEGEN_DIR, exist_ok=True)
+
+            with open(tmp, 'wb') as fp:
+                pickle.dump(db, fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+            os.replace(tmp, cache)
+        except OSError:
+            pass
+
+    _DATABASES[key] = db
+    return db
+
+
+def tdb_function(db, name, memo=None):
+    """ Symbolic expression of function `name` of database `db`. """
+    memo = {} if memo is None else memo
+
+    if name not in memo:
+        memo[name] = tdb_expression(db, db['functions'][name], memo)
+
+    return memo[name]
+
+
+def tdb_expression(db, segments, memo=None):
+    """ Symbolic expression of piecewise (in temperature) function.
+
+    Beyond the last temperature range its expression is extrapolated.
+    """
+    _, segments = segments
+    expr = None
+
+    for t_high, terms in reversed(segments):
+        value = 0
+
+        for coef, k, m, name in terms:
+            term = coef * T**k * ln(T)**m
+
+            if name is not None:
+                term *= tdb_function(db, name, memo)
+
+            value += term
+
+        expr = value if expr is None else if_else(T < t_high, value, expr)
+
+    return expr
+
+
+def _tdb_occupancy(db, phase, component):
+    """ Mixing sublattice of phase and atoms as linear functions of y.
+
+    Returns index `j` and number of sites `c` of mixing sublattice and
+    pairs of constant and slope in site fraction `y` of first of its
+    constituents of number of atoms and of atoms of `component`.
+    """
+    data = db['phases'][phase]
+    sites, constituents = data['sites'], data['constituents']
+
+    mixing = [i for i, sub in enumerate(constituents) if len(sub) == 2]
+
+    if len(mixing) != 1 or any(len(sub) > 2 for sub in constituents):
+        raise ValueError(f'{phase} has no single binary mixing sublattice')
+
+    j = mixing[0]
+    c = sites[j]
+
+    def count(f):
+        """ Constant and slope in `y` of sites occupied by `f` atoms. """
+        const = sum(s * f(sub[-1]) for s, sub in zip(sites, constituents))
+        slope = c * (f(constituents[j][0]) - f(constituents[j][1]))
+        return const, slope
+
+    # All atoms and atoms of `component` per formula unit.
+    return j, c, count(lambda ci: ci != 'VA'), \
+        count(lambda ci: ci == component)
+
+
+def tdb_phase_limits(db, phase, component):
+    """ Range of mole fraction of `component` spanned by phase. """
+    _, _, (a0, a1), (b0, b1) = _tdb_occupancy(db, phase, component)
+    limits = (b0 / a0 if a0 else np.nan, (b0 + b1) / (a0 + a1))
+    return min(limits), max(limits)
+
+
+def tdb_phase_energy(db, phase, x, component, memo=None):
+    """ Molar Gibbs energy of binary phase with one mixing sublattice.
+
+    Energy is given per mole of atoms as a function of mole fraction
+    `x` of `component`. Other sublattices, if any, must be occupied by
+    a single constituent. Parameters missing in `db` are taken as zero.
+    """
+    memo = {} if memo is None else memo
+    j, c, (a0, a1), (b0, b1) = _tdb_occupancy(db, phase, component)
+    data = db['phases'][phase]
+    constituents = data['constituents']
+
+    # Invert mole fraction relation for site fraction of first.
+    y = (a0 * x - b0) / (b1 - a1 * x)
+
+    def series(kind):
+        """ End-member values and interactions of parameter `kind`. """
+        def key(sub, order=0):
+            subs = tuple(tuple(sorted(sub)) if i == j else s
+                         for i, s in enumerate(constituents))
+            return (kind, phase, subs, order)
+
+        def value(k):
+            return tdb_expression(db, db['parameters'][k], memo) \
+                if k in db['parameters'] else 0
+
+        g_end = [value(key((ci,))) for ci in constituents[j]]
+        l_mix = [value(key(constituents[j], order)) for order in
+                 range(1 + max([k[3] for k in db['parameters']
+                                if k[:3] == key(constituents[j])[:3]],
+                               default=-1))]
+
+        # Interactions are defined for sorted constituents.
+        if sorted(constituents[j]) != list(constituents[j]):
+            l_mix = [(-1)**k * l_k for k, l_k in enumerate(l_mix)]
+
+        return g_end, l_mix
+
+    if data['magnetic'] is None:
+        Tc = beta = p = afm = None
+    else:
+        afm, p = data['magnetic']
+        Tc, beta = series('TC'), series('BMAG')
+
+    Gm = g_sublaticce(y, *series('G'), c, Tc, beta, p, afm)
+
+    # Normalize from formula unit to mole of atoms.
+    return Gm / (a0 + a1 * y)
+
+
+TDB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'Frisk1991.tdb')
+
+
+def get_gibbs_energies(fname=TDB_FILE, phases=('BCC_A2', 'FCC_A1'),
+                       component='N'):
+    """ Symbolic molar Gibbs energies of phases from TDB database. """
+    db = read_tdb(fname)
+    memo = {}
+
+    # Symbols for molar fraction of nitrogen in phases.
+    x_nn = SX.sym('x_nn', len(phases))
+
+    return (x_nn, *(tdb_phase_energy(db, phase, x_nn[k], component, memo)
+                    for k, phase in enumerate(phases)))
+
+
 def get_symbols():
     ###############################################################
     # SYSTEM
@@ -154,7 +615,7 @@ def get_symbols():
 
     # Symbols for unknowns: phases fractions and compositions.
     phi = SX.sym('phi', 2)
-    x_nn = SX.sym('x_nn', 2)
+    x_nn, Gm_alpha, Gm_gamma = get_gibbs_energies()
 
     # Aliases for phases fractions.
     phi_alpha = phi[0]
@@ -164,73 +625,6 @@ def get_symbols():
     x_nn_alpha = x_nn[0]
     x_nn_gamma = x_nn[1]
 
-    ###############################################################
-    # REFERENCES
-    ###############################################################
-    
-    # SER : BCC_A2 : CHECKED
-    a_ghser_fe = (1224.83, 124.134, -23.5143, -4.39752e-03, -5.89269e-08, 77358.5)
-    ghser_fe = gparams(a_ghser_fe)
-
-    # SER : 1/2 N2 : CHECKED
-    a_ghser_nn = (-3750.675, -9.45425, -12.7819, -1.76686e-04, 2.681e-09, -32374)
-    ghser_nn = gparams(a_ghser_nn) * (1/2)
-    
-    ###############################################################
-    # ALPHA
-    ###############################################################
-    
-    # G(BCC_A2,FE:VA;0) : CHECKED
-    g_fe_va_alpha = ghser_fe
-
-    # G(BCC_A2,FE:N;0) : CHECKED
-    a_g_fe_nn_alpha = (93562, 165.07, 0, 0, 0, 0)
-    g_fe_nn_alpha = gparams(a_g_fe_nn_alpha) + ghser_fe + 3 * ghser_nn
-
-    # Magnetic model parameters : CHECKED.
-    Tc_alpha, beta_alpha, p_alpha, afm_alpha = 1043, 2.22, 0.40, -1
-
-    # BCC_A2 R-K parameter : CHECKED.
-    l_fe_nn_va_alpha = 0.0
-
-    # Stoichiometric parameter : CHECKED.
-    c_alpha = 3
-    
-    ###############################################################
-    # GAMMA
-    ###############################################################
-    
-    # G(FCC_A1,FE:VA;0) : CHECKED.
-    a_g_fe_va_gamma = (-1462.4, 8.282, -1.15, 6.4e-04, 0.0, 0.0)
-    g_fe_va_gamma = gparams(a_g_fe_va_gamma) + ghser_fe
-
-    # G(FCC_A1,FE:N;0) : CHECKED.
-    a_g_fe_nn_gamma = (-37460, 375.42, -37.6, 0, 0, 0)
-    g_fe_nn_gamma = gparams(a_g_fe_nn_gamma) + ghser_fe + ghser_nn
-
-    # Magnetic model parameters: CHECKED.
-    Tc_gamma, beta_gamma, p_gamma, afm_gamma = -201, -2.1, 0.28, -3
-
-    # FCC_A1 R-K parameter : CHECKED.
-    l_fe_nn_va_gamma = -26150.0
-
-    # Stoichiometric parameter : CHECKED.
-    c_gamma = 1
-    
-    ###############################################################
-    # COMPUTE MOLAR GIBBS ENERGIES
-    ###############################################################
-    
-    # BCC_A2 molar Gibbs energy.
-    Gm_alpha = g_sublaticce(x_nn_alpha, g_fe_nn_alpha, g_fe_va_alpha,
-                            l_fe_nn_va_alpha, c_alpha, Tc_alpha,
-                            beta_alpha, p_alpha, afm_alpha)
-
-    # FCC_A1 molar Gibbs energy.
-    Gm_gamma = g_sublaticce(x_nn_gamma, g_fe_nn_gamma, g_fe_va_gamma,
-                            l_fe_nn_va_gamma, c_gamma, Tc_gamma,
-                            beta_gamma, p_gamma, afm_gamma)
-
     ###############################################################
     # ASSEMBLY OPTIMIZATION PROBLEM
     ###############################################################
@@ -251,27 +645,249 @@ def get_symbols():
 
     return x, p, g, f
 
+
+
+def lower_convex_hull(x, g):
+    """ Indices of vertices of lower convex hull of points sorted in `x`.
+
+    In each pass all points not below the chord joining their current
+    neighbours are dropped at once, which never removes vertices of the
+    hull, until the remaining sequence is convex.
+    """
+    keep = np.arange(len(x))
+
+    while len(keep) > 2:
+        xk, gk = x[keep], g[keep]
+        chord = gk[:-2] + (gk[2:] - gk[:-2]) *\
+            (xk[1:-1] - xk[:-2]) / (xk[2:] - xk[:-2])
+        above = np.flatnonzero(gk[1:-1] >= chord) + 1
+
+        if not above.size:
+            break
+
+        keep = np.delete(keep, above)
+
+    return keep
+
+
+def get_hull_calculator(fname=TDB_FILE, phases=('BCC_A2', 'FCC_A1'),
+                        component='N', n=1000, maxsize=1000):
+    """ Global minimization from lower convex hull of sampled phases.
+
+    Gibbs energies of `phases` are sampled over `n` compositions each
+    (clustered towards the limits of their composition ranges) and the
+    lower convex hull of all samples is computed once per temperature
+    (keeping the last `maxsize` ones). The facet of the hull containing
+    each point provides the stable phases, their fractions and their
+    compositions; compositions of absent phases are taken where their
+    energies are closest to the tangent of the hull (parallel tangent).
+    Results are ordered as the unknowns of the equilibrium problem,
+    i.e. phase fractions followed by compositions of each phase.
+    """
+    db = read_tdb(fname)
+    x_nn, *Gm = get_gibbs_energies(fname, phases, component)
+    gm = Function('gm', [T, x_nn], [vertcat(*Gm)])
+
+    # Sample compositions clustered at both ends of phases ranges.
+    half = np.geomspace(1.0e-09, 0.5, n // 2)
+    frac = np.unique(np.concatenate((half, 1 - half)))
+    lims = np.array([tdb_phase_limits(db, p, component) for p in phases])
+    X = lims[:, :1] + (lims[:, 1:] - lims[:, :1]) * frac
+
+    nph = len(phases)
+    cache = OrderedDict()
+    lock = threading.Lock()
+
+    def vertices(T0):
+        """ Samples energies and hull vertices at temperature `T0`. """
+        with lock:
+            if T0 in cache:
+                cache.move_to_end(T0)
+                return cache[T0]
+
+        g = gm(T0, X).full()
+
+        # All samples sorted by composition, lowest energy first.
+        xs, gs = X.ravel(), g.ravel()
+        ks = np.repeat(np.arange(nph), X.shape[1])
+        order = np.lexsort((gs, xs))
+        order = order[np.isfinite(gs[order])]
+        order = order[np.r_[True, np.diff(xs[order]) > 0]]
+
+        idx = order[lower_convex_hull(xs[order], gs[order])]
+        value = g, xs[idx], gs[idx], ks[idx]
+
+        with lock:
+            cache[T0] = value
+
+            if len(cache) > maxsize:
+                cache.popitem(last=False)
+
+        return value
+
+    def hull(T0_num, w0_num):
+        """ Global equilibrium estimate at arrays of points. """
+        w0_num = np.atleast_1d(np.asarray(w0_num, dtype=float))
+        T0_num = np.broadcast_to(np.asarray(T0_num, dtype=float),
+                                 w0_num.shape)
+        x0_num = mass_to_mole_fraction(w0_num)
+        sol = np.zeros((w0_num.size, 2 * nph))
+
+        for T_k in np.unique(T0_num):
+            at = np.flatnonzero(T0_num == T_k)
+            g, xv, gv, kv = vertices(T_k)
+
+            # Facets of the hull containing points.
+            i = np.clip(np.searchsorted(xv, x0_num[at]), 1, len(xv) - 1)
+            xl, xr = xv[i - 1], xv[i]
+            slope = (gv[i] - gv[i - 1]) / (xr - xl)
+            phi = np.clip((x0_num[at] - xl) / (xr - xl), 0, 1)
+
+            # Parallel tangent compositions of all phases, once per
+            # facet so that memory does not grow with number of points.
+            _, first, inv = np.unique(i, return_index=True,
+                                      return_inverse=True)
+            dist = g[:, None, :] - slope[first, None] * X[:, None, :]
+            sol[at, nph:] = np.take_along_axis(
+                X, np.argmin(dist, axis=2), axis=1).T[inv]
+
+            # Stable phases lie on facet ends (or cover whole facet).
+            single = kv[i - 1] == kv[i]
+            sol[at, kv[i - 1]] += 1 - phi
+            sol[at, kv[i]] += phi
+            sol[at, nph + kv[i - 1]] = np.where(single, x0_num[at], xl)
+            sol[at, nph + kv[i]] = np.where(single, x0_num[at], xr)
+
+        return sol
+
+    return hull
+
+
+def compile_function(name, generate, depends=(TDB_FILE,)):
+    """ Path to shared library compiled from generated C code.
+
+    Function `generate` is called with a file name to write the code
+    to, which is compiled with `$CC` (default `gcc`). Libraries are
+    cached in `CODEGEN_DIR` under a name keyed by this module source,
+    contents of files it `depends` on (databases) and CasADi version,
+    thus code is only generated once.
+    """
+    key = casadi_version.encode()
+
+    for fname in (__file__, *depends):
+        with open(fname, 'rb') as fp:
+            key += fp.read()
+
+    import subprocess
+
+    key = f'{name}_{sha1(key).hexdigest()[:12]}'
+    lib = os.path.join(CODEGEN_DIR, f'{key}.so')
+
+    if os.path.exists(lib):
+        return lib
+
+    # CasADi generates code in working directory.
+    src = f'{key}_{os.getpid()}.c'
+    tmp = f'{lib}.{os.getpid()}'
+    os.makedirs(CODEGEN_DIR, exist_ok=True)
+
+    try:
+        generate(src)
+        cmd = [os.environ.get('CC', 'gcc'), '-fPIC', '-shared', '-O2',
+               src, '-o', tmp]
+        subprocess.run(cmd, check=True)
+        os.replace(tmp, lib)
+    finally:
+        if os.path.exists(src):
+            os.remove(src)
+
+    return lib
+
+
+def get_system_calculator(codegen=False, capture=False, log_file=None):
+    """ Equilibrium calculator, optionally from compiled NLP problem.
+
+    Solver output is disabled unless `capture` is set, then the log of
+    each call is returned by the calculator as a list of lines, or a
+    `log_file` is provided, to which Ipopt writes its log.
+
+    As Ipopt instances cannot be shared between threads, a solver is
+    created for each thread calling the calculator.
+
+    Multipliers `lam_x0` and `lam_g0` of a previous solution can be
+    provided together with its primal `guess` to warm start Ipopt, as
+    done by `trace_equilibrium`. Solver statistics (such as number of
+    iterations `iter_count`) of each call are stored under `stats`.
+    """
+    opts = {'print_time': capture,
+            'ipopt': {'print_level': 5 if capture else 0, 'sb': 'yes'}}
+
+    if log_file is not None:
+        opts['ipopt'].update(output_file=log_file, file_print_level=5)
+
+    # Start close to the solution with a small barrier parameter.
+    opts_warm = {**opts, 'ipopt': {**opts['ipopt'],
+                                   'warm_start_init_point': 'yes',
+                                   'warm_start_bound_push': 1.0e-09,
+                                   'warm_start_mult_bound_push': 1.0e-09,
+                                   'mu_init': 1.0e-06}}
+
+    if codegen:
+        def generate(src):
+            x, p, g, f = get_symbols()
+            nlpt = {'x': x, 'f': f, 'g': g, 'p': p}
+            nlpsol('nlp', 'ipopt', nlpt).generate_dependencies(
+                src, {'with_header': False})
+
+        nlpt = compile_function('nlp', generate)
+    else:
+        # Construct optimization problem.
+        x, p, g, f = get_symbols()
+        nlpt = {'x': x, 'f': f, 'g': g, 'p': p}
+
+    local = threading.local()
+
+    def get_solver(warm=False):
+        """ Solver instance of calling thread. """
+        if not hasattr(local, 'solvers'):
+            local.solvers = {}
+
+        if warm not in local.solvers:
+            local.solvers[warm] = nlpsol('solver', 'ipopt', nlpt,
+                                         opts_warm if warm else opts)
+
+        return local.solvers[warm]
     
-def get_system_calculator():
-    x, p, g, f = get_symbols()
-    
-    # Construct optimization problem.
-    opts = {'ipopt': {'print_level': 5}}
-    nlpt = {'x': x, 'f': f, 'g': g, 'p': p}
-    solver = nlpsol('solver', 'ipopt', nlpt, opts)
-    
-    def ce(T0_num, w0_num, guess=None, kn=0.05, tol=1.0e-06):
+    def ce(T0_num, w0_num, guess=None, kn=0.05, tol=1.0e-06,
+           lam_x0=None, lam_g0=None):
         """ Compute equilibrium at given point. """
         x0_num = mass_to_mole_fraction(w0_num)
 
-        # A good initial guess is expected for now.
+        # Start from global minimum of sampled phases.
         if guess is None:
-            guess = [1, 1, x0_num, x0_num]
+            guess = HULL(T0_num, w0_num)[0]
 
-        with Capturing() as output:
-            sol = solver(x0=guess, p=[T0_num, x0_num],
-                         lbx=0, ubx=1, lbg=-tol, ubg=tol)
+        args = dict(x0=guess, p=[T0_num, x0_num],
+                    lbx=0, ubx=1, lbg=-tol, ubg=tol)
 
+        # Warm start only if multipliers are known.
+        warm = lam_x0 is not None and lam_g0 is not None
+
+        if warm:
+            args.update(lam_x0=lam_x0, lam_g0=lam_g0)
+
+        solver = get_solver(warm)
+        output = Capturing()
+
+        if capture:
+            with output:
+                sol = solver(**args)
+        else:
+            sol = solver(**args)
+
+        sol['stats'] = solver.stats()
+        RunStats.count('ipopt_calls')
+        RunStats.count('ipopt_iterations', sol['stats']['iter_count'])
         sol['ac'] = nitrogen_activity(kn, sol['f'], T0_num)
         sol['x0'] = x0_num
         sol['w0'] = w0_num
@@ -281,188 +897,1482 @@ def get_system_calculator():
     return ce
 
 
-CE = get_system_calculator()
+class LazyCalculator:
+    """ Calculator constructed by `factory` at its first call. """
+    def __init__(self, factory):
+        self._factory = factory
+        self._calculator = None
+        self._lock = threading.Lock()
 
+    def __call__(self, *args, **kwargs):
+        if self._calculator is None:
+            with self._lock:
+                if self._calculator is None:
+                    self._calculator = self._factory()
 
-def equilibrate(T, w, guess=None):
-    return CE(T, w, guess=guess)[0]["x"].full().flatten()
+        return self._calculator(*args, **kwargs)
 
 
-class NitridingLayer:
-    """ Nitriding simulation with phase transformation (local equilibria). """
-    @staticmethod
-    def _coef_steel(T, d0, ea, R=8.314472):
-        """ Generic Arrhenius law for diffision coefficient. """
-        return d0 * np.exp(-ea / (R * T))
+HULL = LazyCalculator(get_hull_calculator)
 
-    @staticmethod
-    def _coef_gamma(T):
-        """ Diffusion coefficient of nitrogen in austenite. """
-        return NitridingLayer._coef_steel(T, d0=4.84e-05, ea=155000.0)
+CE = LazyCalculator(lambda: get_system_calculator(codegen=CODEGEN))
 
-    @staticmethod
-    def _coef_alpha(T):
-        """ Diffusion coefficient of nitrogen in ferrite. """
-        return NitridingLayer._coef_steel(T, d0=4.87e-07, ea=80640.0)
 
-    @staticmethod
-    def _coef_mixture(T, u, guess):
-        """ Volume averaged diffusion coefficient in mixture. """
-        guess = NitridingLayer.fraction_alpha(T, u, guess)
-        v = guess[:, 0]
+def equilibrate(T, w, guess=None):
+    return CE(T, w, guess=guess)[0]["x"].full().flatten()
 
-        # PARALLEL RESISTANCE MODEL
-        inv_alpha = (0 + v) / NitridingLayer._coef_alpha(T)
-        inv_gamma = (1 - v) / NitridingLayer._coef_gamma(T)
-        return 1.0 / (inv_alpha + inv_gamma), guess
 
-        # MIXTURE MODEL
-        # dir_alpha = NitridingLayer._coef_alpha(T) * v
-        # dir_gamma = NitridingLayer._coef_gamma(T) * (1 - v) 
-        # return dir_alpha + dir_gamma
+def trace_equilibrium(T, w, guess=None, calculator=None):
+    """ Equilibrium traced along paths of temperatures and compositions.
+
+    Points along first axis of `T` and `w` (broadcast against each
+    other, `T` being possibly a schedule `T(t)` evaluated at times and
+    `w` an array of compositions of shape `(nt, nx)`) are solved in
+    sequence, each warm started from the primal and dual solution of
+    the previous point. Initial `guess` is used for the first point.
+    A `calculator` replacing `CE` must accept multipliers `lam_x0` and
+    `lam_g0` and report solver statistics as `get_system_calculator`.
+
+    Returns
+    -------
+    tuple
+        Equilibria `[phi_alpha, phi_gamma, x_alpha, x_gamma]` over
+        last axis and structured array of solver statistics (`iter`
+        count, `success` flag and `status` returned by Ipopt), both
+        with the broadcast shape of inputs.
+    """
+    if calculator is None:
+        calculator = CE
 
-        # LABYRINTH MODEL
-        # return NitridingLayer._coef_alpha(T) * (1 - v) ** 2
+    T = np.atleast_1d(np.asarray(T, dtype=float))
+    w = np.atleast_1d(np.asarray(w, dtype=float))
 
-    @staticmethod
-    def fraction_alpha(T, u, guess):
-        """ Composition and temperature phase fraction dependency. """
-        return np.array([equilibrate(T, uk, guess=guess[k])
-                         for k, uk in enumerate(u)])
+    # Temperatures along path apply to all compositions.
+    T = T.reshape(T.shape + (1,) * (w.ndim - T.ndim))
+    T, w = np.broadcast_arrays(T, w)
+    shape = T.shape
 
-    def _beta(self, u, t, T=None):
-        """ Return numerical scheme coefficient. """
-        T = self._temperature(t) if T is None else T
-        coef, self._guess = self._coef_mixture(T, u, self._guess)
-        return coef / self._dx2
+    T = T.reshape(shape[0], -1)
+    w = w.reshape(shape[0], -1)
 
-    def _face_coefficient(self, u, t):
-        """ Model coefficients on cell interfaces. """
-        beta = self._beta(u, t)
-        return 2 * (beta[:-1] * beta[1:]) / (beta[:-1] + beta[1:])
+    sol = np.zeros(T.shape + (4,))
+    stats = np.zeros(T.shape, dtype=[('iter', 'i4'), ('success', '?'),
+                                     ('status', 'U32')])
 
-    def _get_problem_matrix(self, u, t):
-        """ Create sparse diffusion integration matrix. """
-        # Compute coefficients on interfaces of cells.
-        k = self._face_coefficient(u, t) * self._dt
-    
-        # Compute main diagonal of implicit problem.
-        mm = 1 + (k[:-1] + k[1:])
-    
-        # Stack main diagonals with B.C.
-        # mm = np.hstack((1.0, mm, 1.0 + k[-1]))
-        mm = np.hstack((1.0, mm, 1.0))
+    if guess is not None:
+        guess = np.asarray(guess, dtype=float).reshape(-1, 4)
 
-        # Upper diagonal starting with Dirichlet B.C.
-        ke = np.hstack((0.0, -1 * k[:-1]))
+    for j in range(T.shape[1]):
+        g = None if guess is None else guess[j % len(guess)]
+        lam_x0 = lam_g0 = None
 
-        # Lower diagonal ending with symmetry B.C.
-        # kw = np.hstack((-1 * k[1:], -k[-1]))
-        kw = np.hstack((-1 * k[1:], 0.0))
+        for k in range(T.shape[0]):
+            res = calculator(T[k, j], w[k, j], guess=g, lam_x0=lam_x0,
+                             lam_g0=lam_g0)[0]
 
-        # Compose tridiagonal problem matrix.
-        M = sparse.diags(mm, offsets=0) +\
-            sparse.diags(kw, offsets=-1) +\
-            sparse.diags(ke, offsets=1)
-    
-        return M.tocsr()
+            # Next point starts from current solution.
+            g, lam_x0, lam_g0 = res['x'], res['lam_x'], res['lam_g']
 
-    def __call__(self, t, u):
-        """ Problem derivatives for mass fraction of nitrogen. """
-        # Allocate memory and set first B.C./derivative to zero.
-        udot = np.zeros_like(u)
+            sol[k, j] = g.full().ravel()
+            stats[k, j] = (res['stats']['iter_count'],
+                           res['stats']['success'],
+                           res['stats']['return_status'])
 
-        # Compute coefficients on interfaces of cells.
-        k = self._face_coefficient(u, t)
-        
-        # Fluxes on "East" faces.
-        de_x_ue = k[1:] * u[2:]
+    return sol.reshape(shape + (4,)), stats.reshape(shape)
 
-        # Fluxes on "West" faces.
-        dw_x_uw = k[:-1] * u[:-2]
 
-        # Compute inner domain derivatives.
-        udot[1:-1] = de_x_ue - (k[:-1] + k[1:]) * u[1:-1] + dw_x_uw
+def get_tangent_calculator(codegen=False):
+    """ Common tangent residuals and Jacobian between phases.
 
-        # Apply symmetry B.C. to problem.
-        # udot[-1] = k[-1] * (u[-2] - u[-1])
+    For a binary two-phase system the equilibrium compositions of
+    phases depend only on temperature and are given by the equality
+    of chemical potentials of both components, which is expressed
+    here as equality of slopes and intercepts of Gibbs energies.
+    """
+    if codegen:
+        generate = lambda src: get_tangent_calculator().generate(src)
+        return external('tangent', compile_function('tangent', generate))
+
+    x_nn, Gm_alpha, Gm_gamma = get_gibbs_energies()
+
+    # Slopes of molar Gibbs energies.
+    dg_alpha = gradient(Gm_alpha, x_nn)[0]
+    dg_gamma = gradient(Gm_gamma, x_nn)[1]
+
+    # Intercepts of tangents at pure iron side.
+    mu_alpha = Gm_alpha - x_nn[0] * dg_alpha
+    mu_gamma = Gm_gamma - x_nn[1] * dg_gamma
+
+    # Residuals and (column-major flattened) Jacobian.
+    r = vertcat(dg_alpha - dg_gamma, mu_alpha - mu_gamma)
+    j = reshape(jacobian(r, x_nn), 4, 1)
+
+    return Function('tangent', [T, x_nn], [r, j])
+
+
+def get_batch_calculator(ce, codegen=False):
+    """ Vectorized equilibrium calculator with fallback to `ce`. """
+    tangent = get_tangent_calculator(codegen=codegen)
+    properties = LazyCalculator(
+        lambda: get_property_calculator(codegen=codegen))
+
+    def ce_batch(T0_num, w0_num, guess=None, maxiter=50, tol=1.0e-09):
+        """ Compute equilibrium at arrays of points in a single call.
+
+        Phase boundaries are found by a vectorized Newton method (on
+        the logarithm of compositions) for each distinct temperature,
+        then phase fractions follow from the lever rule. Points for
+        which no two-phase tangent is found are assigned the phase of
+        lowest Gibbs energy, unless the convex hull of phases finds
+        them in a two-phase field; only the latter are solved by `ce`.
+        """
+        w0_num = np.atleast_1d(np.asarray(w0_num, dtype=float))
+        T0_num = np.broadcast_to(np.asarray(T0_num, dtype=float),
+                                 w0_num.shape)
+        x0_num = mass_to_mole_fraction(w0_num)
 
-        return udot
+        # Common tangent depends only on temperature.
+        T_uniq, inv = np.unique(T0_num, return_inverse=True)
 
-    def _build(self, t_end, x_end, u0, T, **kwargs):
-        """ Prepare problem internals for simulation. """
-        # Discretize time, retrieve steps.
-        nt = kwargs.get('nt', int(t_end) + 1)
-        t_eval, self._dt = np.linspace(0, t_end, nt, retstep=True)
+        # Typical compositions at nitriding temperatures.
+        xs = np.tile([[3.0e-03], [6.0e-02]], (1, T_uniq.size))
 
-        # Discretize space, retrieve steps, transform values.
-        self._x, dx = np.linspace(0.0, x_end, len(u0), retstep=True)
-        self._x *= 1_000_000
-        self._dx2 = dx * dx
+        # Warm start from points found in two-phase field.
+        if guess is not None:
+            guess = np.asarray(guess)
+            both = (guess[:, 0] > 0) & (guess[:, 1] > 0) &\
+                   (guess[:, 0] < 1) & (guess[:, 1] < 1)
+            xs[:, inv[both]] = guess[both, 2:].T
 
-        # Store values for post-processing.
-        self._temperature = T
-        self._T_end = T(t_end)
+        with np.errstate(all='ignore'):
+            for it in range(maxiter):
+                r, j = (v.full() for v in tangent(T_uniq[None, :], xs))
+                a, c, b, d = j * xs[[0, 0, 1, 1]]
 
-        # Compute initial guess.
-        self._guess = np.array([equilibrate(T(0), uk) for uk in u0])
-        
-        return t_eval
+                # Solve 2x2 Newton systems and limit step size.
+                det = a * d - b * c
+                dz = np.vstack((d * r[0] - b * r[1],
+                                a * r[1] - c * r[0])) / det
+                dz = np.clip(dz, -1, 1)
+                xs *= np.exp(-dz)
 
-    def _plot_final_profile(self, u):
-        """ Display integration results (profiles). """
-        v = self.fraction_alpha(self._T_end, u, self._guess)[:, 0]
-        beta = self._beta(u, None, T=self._T_end)
+                if np.all(np.abs(dz) < tol):
+                    break
 
-        plt.close('all')
-        plt.style.use('seaborn-whitegrid')
-        fig = plt.figure(figsize=(12, 9))
+            ok = np.all(np.abs(dz) < tol, axis=0) & (xs[0] < xs[1])
 
-        ax = plt.subplot(311)
-        plt.plot(self._x, 100 * u)
-        plt.ylabel("Nitrogen content [%wt]")
+            # Apply lever rule to all points.
+            xa, xg = xs[:, inv]
+            phi = np.clip((xg - x0_num) / (xg - xa), 0, 1)
 
-        ax = plt.subplot(312, sharex=ax)
-        plt.plot(self._x, 100 * v)
-        plt.ylabel("Ferrite fraction [%]")
+        sol = np.column_stack((phi, 1 - phi,
+                               np.where(phi >= 1, x0_num, xa),
+                               np.where(phi <= 0, x0_num, xg)))
 
-        ax = plt.subplot(313, sharex=ax)
-        plt.plot(self._x, beta)
-        plt.ylabel("Problem constant [1/s]")
-        plt.xlabel("Position [µm]")
+        # Single stable phase where tangent failed (e.g. above A3).
+        failed = ~ok[inv]
+        k = np.flatnonzero(failed)
 
-        plt.tight_layout()
+        if k.size:
+            hull = HULL(T0_num[k], w0_num[k])
+            single = (hull[:, :2] == 0).any(axis=1)
+            gm = properties(T0_num[k], x0_num[k])['Gm']
+            alpha = gm[:, 0] <= gm[:, 1]
 
-        return fig
+            k = k[single]
+            sol[k] = np.column_stack((alpha[single], ~alpha[single],
+                                      x0_num[k], x0_num[k]))
+            failed[k] = False
 
-    def solve_explicit(self, t_end, x_end, u0, T, **kwargs):
-        """ Simulate explicit problem with provided conditions. """
-        t_eval = self._build(t_end, x_end, u0, T, **kwargs)
-        opts = dict(method='RK23', t_eval=t_eval, vectorized=False,
-                    max_step=kwargs.get('max_step', 1.0))
-        self._sol = integrate.solve_ivp(self, [0, t_end], u0, **opts)
+        RunStats.count('batch_points', w0_num.size)
+        RunStats.count('newton_iterations', it + 1)
+        RunStats.count('fallback_points', np.count_nonzero(failed))
 
-        if not self._sol.success:
-            raise ValueError('Last simulation failed...')
+        # Fallback to full minimization in ambiguous points.
+        for k in np.flatnonzero(failed):
+            g = None if guess is None else guess[k]
+            sol[k] = ce(T0_num[k], w0_num[k], guess=g)[0]['x'].full().ravel()
 
-        return self._plot_final_profile(self._sol.y.T[-1])
+        return sol
 
-    def solve_implicit(self, t_end, x_end, u0, T, **kwargs):
-        """ Simulate implicit problem with provided conditions. """
-        t_eval = self._build(t_end, x_end, u0, T, **kwargs)
-        u = u0.copy()
+    return ce_batch
 
-        for k, t in enumerate(t_eval):
-            u[0] = u[-1] = u0[0]
-            
-            if not k % kwargs.get("ofreq", 10):
-                print(f"Advancing at {t:.2f} s")
 
-            M = self._get_problem_matrix(u, t)
-            u = sparse.linalg.spsolve(M, u)
+CE_BATCH = LazyCalculator(lambda: get_batch_calculator(CE, codegen=CODEGEN))
+
+
+def equilibrate_batch(T, w, guess=None):
+    """ Equilibrium [phi_alpha, phi_gamma, x_alpha, x_gamma] of arrays. """
+    return CE_BATCH(T, w, guess=guess)
+
+
+def get_property_calculator(fname=TDB_FILE, phases=('BCC_A2', 'FCC_A1'),
+                            codegen=False, chunk=100_000,
+                            parallelization='serial'):
+    """ Vectorized evaluator of thermodynamic properties of phases.
+
+    Returns a function of arrays of temperatures `T` and mole fractions
+    of nitrogen `x` (broadcast against each other) providing a dict of
+    molar Gibbs energies `Gm`, chemical potentials of iron `mu_fe` and
+    nitrogen `mu_nn` and activity of nitrogen `ac` (with respect to
+    1/2 N2 gas, GHSERNN) of each phase over the last axis. Points are
+    evaluated by chunks of `chunk` points by a mapped CasADi function
+    (`parallelization` can be `serial`, `openmp` or `thread`).
+    """
+    if codegen:
+        generate = lambda src: get_property_calculator(
+            fname, phases)._function.generate(src)
+        name = '_'.join(('properties', *phases)).lower()
+        lib = compile_function(name, generate, (fname,))
+        f = external('properties', lib)
+    else:
+        x_nn, *Gm = get_gibbs_energies(fname, phases)
+        x = SX.sym('x')
+
+        # Chemical potentials from tangents to molar Gibbs energies.
+        Gm = vertcat(*Gm)
+        dg = vertcat(*(gradient(Gm[k], x_nn)[k]
+                       for k in range(len(phases))))
+        mu_fe = Gm - x_nn * dg
+        mu_nn = Gm + (1 - x_nn) * dg
+
+        # Activity with respect to reference state of element.
+        ref = tdb_function(read_tdb(fname), 'GHSERNN')
+        ac = exp((mu_nn - ref) / (R * T))
+
+        out = [substitute(v, x_nn, x * np.ones(len(phases)))
+               for v in (Gm, mu_fe, mu_nn, ac)]
+        f = Function('properties', [T, x], out,
+                     ['T', 'x'], ['Gm', 'mu_fe', 'mu_nn', 'ac'])
+
+    mapped = {}
+
+    def properties(T_num, x_num):
+        """ Properties of phases at arrays of points. """
+        T_num, x_num = np.broadcast_arrays(np.asarray(T_num, dtype=float),
+                                           np.asarray(x_num, dtype=float))
+        shape = T_num.shape
+        T_num, x_num = T_num.ravel(), x_num.ravel()
+        out = {k: np.empty((T_num.size, len(phases)))
+               for k in f.name_out()}
+
+        for start in range(0, T_num.size, chunk):
+            stop = min(start + chunk, T_num.size)
+            n = stop - start
+
+            if n not in mapped:
+                mapped[n] = f.map(n, parallelization, os.cpu_count())
+
+            res = mapped[n](T_num[None, start:stop], x_num[None, start:stop])
+
+            for k, v in zip(f.name_out(), res):
+                out[k][start:stop] = v.full().T
+
+        return {k: v.reshape(shape + (len(phases),)) for k, v in out.items()}
+
+    properties._function = f
+    return properties
+
+
+class EquilibriumTable:
+    """ Tabulated equilibrium over a rectilinear (T, w) grid.
+
+    Equilibrium is solved once at all nodes of the grid and queries are
+    then served by vectorized linear interpolation. Since phase fractions
+    present kinks at phase boundaries, method `refine` bisects intervals
+    of the grid until the interpolation error there is below tolerance.
+    Points outside the grid are solved with `equilibrate_batch`.
+    """
+    def __init__(self, T, w, table=None):
+        self._T = np.asarray(T, dtype=float)
+        self._w = np.asarray(w, dtype=float)
+
+        if table is None:
+            table = self._solve(self._T, self._w)
+
+        self._table = np.asarray(table)
+        self._update()
+
+    @staticmethod
+    def _solve(T, w):
+        """ Solve equilibrium at all nodes of grid. """
+        return np.stack([equilibrate_batch(Tk, w) for Tk in T])
+
+    def _update(self):
+        """ Create interpolator over current grid. """
+        from scipy import interpolate
+
+        self._interp = interpolate.RegularGridInterpolator(
+            (self._T, self._w), self._table, bounds_error=False,
+            fill_value=np.nan)
+
+    def refine(self, tol=1.0e-03, maxiter=10):
+        """ Bisect grid intervals with phase fraction error above `tol`. """
+        for _ in range(maxiter):
+            Tm = 0.5 * (self._T[:-1] + self._T[1:])
+            wm = 0.5 * (self._w[:-1] + self._w[1:])
+
+            # Error at midpoints of composition intervals.
+            T, w = np.meshgrid(self._T, wm, indexing='ij')
+            exact_w = self._solve(self._T, wm)
+            err_w = np.abs(exact_w[:, :, 0] - self(T.ravel(), w.ravel())[:, 0]
+                           .reshape(T.shape)).max(axis=0)
+
+            # Error at midpoints of temperature intervals.
+            T, w = np.meshgrid(Tm, self._w, indexing='ij')
+            exact_T = self._solve(Tm, self._w)
+            err_T = np.abs(exact_T[:, :, 0] - self(T.ravel(), w.ravel())[:, 0]
+                           .reshape(T.shape)).max(axis=1)
+
+            if err_w.max() <= tol and err_T.max() <= tol:
+                break
+
+            # Splice solved midpoints, solving only crossings of new nodes.
+            new_T, new_w = err_T > tol, err_w > tol
+            nT, nw = len(self._T), len(self._w)
+            T = np.hstack((self._T, Tm[new_T]))
+            w = np.hstack((self._w, wm[new_w]))
+
+            table = np.empty((len(T), len(w), self._table.shape[-1]))
+            table[:nT, :nw] = self._table
+            table[:nT, nw:] = exact_w[:, new_w]
+            table[nT:, :nw] = exact_T[new_T]
+
+            if new_T.any() and new_w.any():
+                table[nT:, nw:] = self._solve(Tm[new_T], wm[new_w])
+
+            iT, iw = np.argsort(T), np.argsort(w)
+            self._T, self._w = T[iT], w[iw]
+            self._table = table[iT][:, iw]
+            self._update()
+
+        return self
+
+    def save(self, fname):
+        """ Store table to disk in `npz` format. """
+        np.savez(fname, T=self._T, w=self._w, table=self._table)
+
+    @classmethod
+    def load(cls, fname):
+        """ Load table previously stored with `save`. """
+        with np.load(fname) as data:
+            return cls(data['T'], data['w'], table=data['table'])
+
+    def __call__(self, T, w, guess=None):
+        """ Equilibrium [phi_alpha, phi_gamma, x_alpha, x_gamma] of arrays. """
+        T, w = np.broadcast_arrays(np.asarray(T, dtype=float),
+                                   np.atleast_1d(np.asarray(w, dtype=float)))
+        sol = self._interp(np.column_stack((T.ravel(), w.ravel())))
+
+        # Solve points out of table range.
+        out = np.isnan(sol[:, 0])
+
+        if out.any():
+            g = None if guess is None else np.asarray(guess)[out]
+            sol[out] = equilibrate_batch(T.ravel()[out], w.ravel()[out],
+                                         guess=g)
+
+        return sol
+
+
+class EquilibriumCache:
+    """ Bounded LRU cache of equilibrium over quantized (T, w) keys.
+
+    Points are identified by temperature and mass fraction rounded to
+    multiples of `tol_T` and `tol_w`, so that repeated (or practically
+    identical) states are not solved again. Distinct missing states of
+    a query are solved together with `calculator`, which defaults to
+    `equilibrate_batch`. Least recently used entries are evicted once
+    the cache holds more than `maxsize` entries.
+    """
+    def __init__(self, calculator=None, tol_T=1.0e-03, tol_w=1.0e-08,
+                 maxsize=100_000):
+        if calculator is None:
+            calculator = equilibrate_batch
+
+        self._calculator = calculator
+        self._tol_T = tol_T
+        self._tol_w = tol_w
+        self._maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __call__(self, T, w, guess=None):
+        """ Equilibrium [phi_alpha, phi_gamma, x_alpha, x_gamma] of arrays. """
+        T, w = np.broadcast_arrays(np.asarray(T, dtype=float),
+                                   np.atleast_1d(np.asarray(w, dtype=float)))
+        T, w = T.ravel(), w.ravel()
+
+        # Quantize states and keep only distinct keys.
+        keys = np.column_stack((np.round(T / self._tol_T),
+                                np.round(w / self._tol_w))).astype(np.int64)
+        keys, first, inv = np.unique(keys, axis=0, return_index=True,
+                                     return_inverse=True)
+
+        sol = np.empty((len(keys), 4))
+        miss = []
+
+        for k, key in enumerate(map(tuple, keys.tolist())):
+            if key in self._data:
+                self._data.move_to_end(key)
+                sol[k] = self._data[key]
+            else:
+                miss.append(k)
+
+        # Solve all missing states at once.
+        if miss:
+            m = first[miss]
+            g = None if guess is None else np.asarray(guess)[m]
+            sol[miss] = self._calculator(T[m], w[m], guess=g)
+
+            for k in miss:
+                self._data[tuple(keys[k])] = sol[k]
+
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+        self.misses += len(miss)
+        self.hits += len(T) - len(miss)
+        RunStats.count('cache_misses', len(miss))
+        RunStats.count('cache_hits', len(T) - len(miss))
+
+        return sol[inv.ravel()]
+
+    def clear(self):
+        """ Remove all entries and reset counters. """
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def info(self):
+        """ Cache statistics: hits, misses, size and hit rate. """
+        total = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, size=len(self),
+                    hit_rate=self.hits / total if total else 0.0)
+
+
+class IncrementalEquilibrium:
+    """ Equilibrium of cells solved again only where their state changed.
+
+    Keeps the state (temperature and mass fraction) and solution of
+    each cell of arrays of constant size. At each call only "dirty"
+    cells, whose mass fraction changed by more than `tol_w` (or their
+    temperature by more than `tol_T`) since they were last solved, are
+    solved with `calculator`, which defaults to `equilibrate_batch`;
+    stored rows are reused for all other cells. A call with a different
+    number of cells solves all of them.
+    """
+    def __init__(self, calculator=None, tol_w=0.0, tol_T=0.0):
+        if calculator is None:
+            calculator = equilibrate_batch
+
+        self._calculator = calculator
+        self._tol_w = tol_w
+        self._tol_T = tol_T
+        self.clear()
+
+    def __call__(self, T, w, guess=None):
+        """ Equilibrium [phi_alpha, phi_gamma, x_alpha, x_gamma] of arrays. """
+        T, w = np.broadcast_arrays(np.asarray(T, dtype=float),
+                                   np.atleast_1d(np.asarray(w, dtype=float)))
+        T, w = T.ravel(), w.ravel()
+
+        if self._w is None or self._w.shape != w.shape:
+            self._T, self._w = T.copy(), w.copy()
+            self._sol = np.empty((w.size, 4))
+            dirty = np.arange(w.size)
+        else:
+            dirty = np.flatnonzero((np.abs(w - self._w) > self._tol_w) |
+                                   (np.abs(T - self._T) > self._tol_T))
+
+        # Solve dirty cells only, tracking change from their last state.
+        if dirty.size:
+            g = None if guess is None else np.asarray(guess)[dirty]
+            self._sol[dirty] = self._calculator(T[dirty], w[dirty], guess=g)
+            self._T[dirty] = T[dirty]
+            self._w[dirty] = w[dirty]
+
+        self.dirty += dirty.size
+        self.clean += w.size - dirty.size
+        RunStats.count('dirty_cells', dirty.size)
+        RunStats.count('clean_cells', w.size - dirty.size)
+
+        return self._sol.copy()
+
+    def clear(self):
+        """ Forget stored cells and reset counters. """
+        self._T = self._w = self._sol = None
+        self.dirty = 0
+        self.clean = 0
+
+    @property
+    def info(self):
+        """ Statistics: dirty and clean cells and share of clean ones. """
+        total = self.dirty + self.clean
+        return dict(dirty=self.dirty, clean=self.clean,
+                    clean_rate=self.clean / total if total else 0.0)
+
+
+def graded_mesh(x_end, n, ratio=1.0, symmetric=True):
+    """ Nodes with spacing growing geometrically away from surfaces.
+
+    Spacing between consecutive nodes grows by `ratio` from the surface
+    at `x = 0` (and from `x = x_end` if `symmetric`, as both ends of the
+    domain are exposed to nitriding atmosphere).
+    """
+    j = np.arange(n - 1)
+    j = np.minimum(j, j[::-1]) if symmetric else j
+
+    dx = np.power(float(ratio), j)
+    return x_end * np.hstack((0.0, np.cumsum(dx))) / dx.sum()
+
+
+class _NpyStream:
+    """ Append-only `.npy` file of records of fixed shape.
+
+    Header is reserved with a fixed size and rewritten after each
+    record, so that the file can be loaded (memory-mapped) at any time.
+    """
+    HEADER = 128
+
+    def __init__(self, fname, shape=(), dtype='<f8', keep=None):
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+
+        if keep is None:
+            self._fp = open(fname, 'wb')
+            self._count = 0
+        else:
+            # Continue existing file after its first `keep` records.
+            self._fp = open(fname, 'r+b')
+            self._count = keep
+            self._fp.truncate(self.HEADER + keep * self._dtype.itemsize
+                              * int(np.prod(self._shape)))
+
+        self._write_header()
+
+    def _write_header(self):
+        """ Write header with current number of records. """
+        header = repr({'descr': np.lib.format.dtype_to_descr(self._dtype),
+                       'fortran_order': False,
+                       'shape': (self._count, *self._shape)})
+        header = header.ljust(self.HEADER - 11) + '\n'
+
+        self._fp.seek(0)
+        self._fp.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header))
+                       + header.encode('latin1'))
+        self._fp.seek(0, os.SEEK_END)
+
+    def append(self, record):
+        """ Append a single record to file. """
+        record = np.asarray(record, dtype=self._dtype)
+
+        if record.shape != self._shape:
+            raise ValueError(f'Expected record of shape {self._shape}')
+
+        self._fp.write(record.tobytes())
+        self._count += 1
+        self._write_header()
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+
+class ProfileWriter:
+    """ Stream simulation snapshots to a directory of `.npy` files.
+
+    Every `every` calls a snapshot of time `t` and profiles of position
+    `x` [µm], nitrogen content `u`, ferrite fraction `alpha` and diffusivity
+    `diffusivity` is appended to the file of same name in `path`, thus
+    memory usage does not grow with simulation length. Profiles may have
+    any (fixed) shape, such as fields of `NitridingSection` which also
+    provides coordinates `y`. Files can be read back (also while the
+    simulation runs) with `load`.
+    """
+
+    def __init__(self, path, every=1):
+        os.makedirs(path, exist_ok=True)
+        self._path = path
+        self._every = every
+        self._calls = 0
+        self._streams = {}
+        self._t_last = None
+
+    def due(self, t, force=False):
+        """ Whether a snapshot at `t` is to be written. """
+        if t == self._t_last:
+            return False
+
+        self._calls += 1
+        return force or not (self._calls - 1) % self._every
+
+    def write(self, t, **profiles):
+        """ Append snapshot to files. """
+        if not self._streams:
+            fname = lambda name: os.path.join(self._path, f'{name}.npy')
+            self._streams['t'] = _NpyStream(fname('t'))
+            self._streams.update({name: _NpyStream(fname(name),
+                                                   np.shape(value))
+                                  for name, value in profiles.items()})
+
+        self._streams['t'].append(t)
+
+        for name, value in profiles.items():
+            self._streams[name].append(value)
+
+        self._t_last = t
+
+    def rewind(self, t, calls=None):
+        """ Continue existing files dropping snapshots after time `t`.
+
+        Cadence is restored from the number of `calls` of `due` up to
+        `t` (as stored in checkpoints), else assuming that the last kept
+        snapshot was written at `t`. Files are started anew if `path`
+        holds no snapshots (e.g. a new directory for a restarted run).
+        """
+        data = self.load(self._path)
+        self.close()
+
+        # Without snapshots (new directory) only cadence is restored.
+        if 't' not in data:
+            self._streams = {}
+            self._t_last = None
+            self._calls = 0 if calls is None else int(calls)
+            return
+
+        keep = int(np.searchsorted(data['t'], t, side='right'))
+        self._t_last = data['t'][keep - 1] if keep else None
+        self._calls = keep * self._every if calls is None else int(calls)
+        self._streams = {
+            name: _NpyStream(os.path.join(self._path, f'{name}.npy'),
+                             data[name].shape[1:], keep=keep)
+            for name in data}
+
+    def close(self):
+        for stream in self._streams.values():
+            stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def load(path):
+        """ Memory-mapped arrays of snapshots stored in `path`. """
+        names = sorted(f[:-4] for f in os.listdir(path) if f.endswith('.npy'))
+
+        return {name: np.load(os.path.join(path, f'{name}.npy'),
+                              mmap_mode='r')
+                for name in names}
+
+
+class _NitridingModel:
+    """ Common parts of nitriding simulations with local equilibria.
+
+    Provides diffusion coefficients, (incremental or split-step)
+    equilibrium updates, implicit integration with fixed or adaptive
+    steps, checkpoints and instrumentation. Subclasses provide the mesh
+    (`_build` and `_restore`), implicit steps (`_step`), snapshots
+    (`_write`) and plots (`_plot_final_profile`).
+
+    Parameters
+    ----------
+    calculator : callable, optional
+        Replacement for `equilibrate_batch` with the same signature, such
+        as an `EquilibriumTable` or an `EquilibriumCache` instance.
+    params : dict, optional
+        Replacement of (some of) the diffusion parameters in `PARAMS`,
+        i.e. pre-exponential factors [m²/s] and activation energies
+        [J/mol] of phases and `mixture` model (one of `MIXTURES`).
+    """
+    PARAMS = dict(d0_alpha=4.87e-07, ea_alpha=80640.0,
+                  d0_gamma=4.84e-05, ea_gamma=155000.0,
+                  mixture='parallel')
+
+    MIXTURES = ('parallel', 'linear')
+
+    def __init__(self, calculator=None, params=None):
+        self._calculator = calculator
+        self._params = {**self.PARAMS, **(params or {})}
+
+        if self._params['mixture'] not in self.MIXTURES:
+            raise ValueError(f"Unknown mixture {self._params['mixture']}")
+
+    @staticmethod
+    def _coef_steel(T, d0, ea, R=8.314472):
+        """ Generic Arrhenius law for diffision coefficient. """
+        return d0 * np.exp(-ea / (R * T))
+
+    @staticmethod
+    def _coef_gamma(T, d0=4.84e-05, ea=155000.0):
+        """ Diffusion coefficient of nitrogen in austenite. """
+        return _NitridingModel._coef_steel(T, d0=d0, ea=ea)
+
+    @staticmethod
+    def _coef_alpha(T, d0=4.87e-07, ea=80640.0):
+        """ Diffusion coefficient of nitrogen in ferrite. """
+        return _NitridingModel._coef_steel(T, d0=d0, ea=ea)
+
+    @staticmethod
+    def _coef_mixture(T, u, guess, calculator=None, params=None):
+        """ Volume averaged diffusion coefficient in mixture. """
+        guess = _NitridingModel.fraction_alpha(T, u, guess, calculator)
+        return _NitridingModel._coef_phases(T, guess[:, 0], params), guess
+
+    @staticmethod
+    def _coef_phases(T, v, params=None):
+        """ Diffusion coefficient of mixture with ferrite fraction `v`. """
+        p = _NitridingModel.PARAMS if params is None else params
+        d_alpha = _NitridingModel._coef_alpha(T, p['d0_alpha'],
+                                              p['ea_alpha'])
+        d_gamma = _NitridingModel._coef_gamma(T, p['d0_gamma'],
+                                              p['ea_gamma'])
+
+        # MIXTURE MODEL
+        if p['mixture'] == 'linear':
+            return d_alpha * v + d_gamma * (1 - v)
+
+        # LABYRINTH MODEL
+        # return d_alpha * (1 - v) ** 2
+
+        # PARALLEL RESISTANCE MODEL
+        inv_alpha = (0 + v) / d_alpha
+        inv_gamma = (1 - v) / d_gamma
+        return 1.0 / (inv_alpha + inv_gamma)
+
+    @staticmethod
+    def fraction_alpha(T, u, guess, calculator=None):
+        """ Composition and temperature phase fraction dependency. """
+        if calculator is None:
+            calculator = equilibrate_batch
+
+        return calculator(T, u, guess=guess)
+
+    def _diffusivity(self, u, t, T=None):
+        """ Return diffusion coefficient at nodes. """
+        T = self._temperature(t) if T is None else T
+
+        if getattr(self, '_split', None):
+            return self._diffusivity_split(u, T)
+
+        calculator = self._calculator
+
+        if getattr(self, '_incremental', None) is not None:
+            calculator = self._incremental
+
+        with self._timer('equilibrium'):
+            coef, self._guess = self._coef_mixture(T, u, self._guess,
+                                                   calculator, self._params)
+
+        RunStats.count('equilibrium_cells', len(u))
+        return coef
+
+    def _set_equilibrium(self, kwargs):
+        """ Options of incremental and split-step equilibrium updates.
+
+        With `dirty_tol=dw` each evaluation of diffusivity solves only
+        cells whose nitrogen content changed by more than `dw` since
+        they were last solved (see `IncrementalEquilibrium`), reusing
+        stored equilibria for the others; `dirty_tol=0` is exact.
+
+        With `split_every=n` equilibrium of all cells is refreshed only
+        every `n` evaluations of diffusivity (or when temperature drifts
+        by more than `split_dT`, default 0.5 K) and with `split_tol=dw`
+        cells whose nitrogen content changed by more than `dw` since
+        their last update are refreshed in between (alone it refreshes
+        only such cells). Diffusion steps use frozen phase fractions.
+        """
+        self._split = dict(every=kwargs.get('split_every', 0),
+                           tol=kwargs.get('split_tol', None),
+                           dT=kwargs.get('split_dT', 0.5))
+
+        if not self._split['every'] and self._split['tol'] is None:
+            self._split = None
+
+        tol = kwargs.get('dirty_tol', None)
+        self._incremental = None if tol is None else \
+            IncrementalEquilibrium(self._calculator, tol_w=tol)
+
+        self._u_eq = None
+        self._T_eq = None
+        self._split_calls = 0
+        self.split_error = 0.0
+
+    def _diffusivity_split(self, u, T):
+        """ Diffusion coefficient at nodes with frozen phase fractions.
+
+        Equilibrium is refreshed following `_set_equilibrium` options.
+        At each refresh ferrite fraction of updated cells is compared
+        to their frozen value, the largest change being kept in
+        `split_error` as an estimate of the error of freezing.
+        """
+        opts = self._split
+        full = self._u_eq is None or abs(T - self._T_eq) > opts['dT'] or \
+            (opts['every'] and self._split_calls >= opts['every'])
+
+        if full:
+            cells = np.arange(len(u))
+        elif opts['tol'] is not None:
+            cells = np.flatnonzero(np.abs(u - self._u_eq) > opts['tol'])
+        else:
+            cells = np.arange(0)
+
+        if cells.size:
+            with self._timer('equilibrium'):
+                v_old = self._guess[cells, 0]
+                self._guess[cells] = self.fraction_alpha(
+                    T, u[cells], self._guess[cells], self._calculator)
+
+            # Change of frozen phase fraction at refresh.
+            if self._u_eq is not None:
+                self.split_error = max(self.split_error, float(np.max(
+                    np.abs(self._guess[cells, 0] - v_old))))
+            else:
+                self._u_eq = np.empty_like(u)
+
+            self._u_eq[cells] = u[cells]
+            RunStats.count('equilibrium_cells', cells.size)
+
+        if full:
+            self._T_eq = T
+            self._split_calls = 0
+
+        self._split_calls += 1
+
+        return self._coef_phases(T, self._guess[:, 0], self._params)
+
+    def _snapshot_diffusivity(self, u, t):
+        """ Diffusion coefficient at nodes for snapshots.
+
+        With split-step updates frozen phase fractions are used, so that
+        writing snapshots does not advance equilibrium refreshes.
+        """
+        if getattr(self, '_split', None):
+            T = self._temperature(t)
+            return self._coef_phases(T, self._guess[:, 0], self._params)
+
+        return self._diffusivity(u, t)
+
+    def _equilibrium_state(self):
+        """ Split-step and incremental equilibrium state for checkpoints. """
+        state = dict(split_calls=self._split_calls,
+                     split_error=self.split_error)
+
+        if self._u_eq is not None:
+            state.update(u_eq=self._u_eq, T_eq=self._T_eq)
+
+        if self._incremental is not None and \
+                self._incremental._w is not None:
+            state.update(eq_T=self._incremental._T,
+                         eq_w=self._incremental._w,
+                         eq_sol=self._incremental._sol)
+
+        return state
+
+    def _restore(self, state):
+        """ Equilibrium guess and state from checkpoint `state`. """
+        self._guess = state['guess']
+        self._split_calls = int(state.get('split_calls', 0))
+        self.split_error = float(state.get('split_error', 0.0))
+
+        if 'u_eq' in state:
+            self._u_eq = state['u_eq'].copy()
+            self._T_eq = float(state['T_eq'])
+
+        if self._incremental is not None and 'eq_w' in state:
+            self._incremental._T = state['eq_T'].copy()
+            self._incremental._w = state['eq_w'].copy()
+            self._incremental._sol = state['eq_sol'].copy()
+
+    def _timer(self, name):
+        """ Timer of section `name` if run statistics are enabled. """
+        stats = getattr(self, '_stats', None)
+        return nullcontext() if stats is None else stats.timer(name)
+
+    def _progress(self, kwargs, step, t, dt=None):
+        """ Report progress to run statistics or print it. """
+        if getattr(self, '_stats', None) is not None:
+            self._stats.progress(step, t, dt)
+        elif not step % kwargs.get('ofreq', 10):
+            extra = '' if dt is None else f' (dt = {dt:.3e} s)'
+            print(f"Advancing at {t:.2f} s{extra}")
+
+    def _remesh(self, u, **kwargs):
+        """ Move nodes following the solution (not supported). """
+        raise ValueError(f'Remeshing not supported by {type(self).__name__}')
+
+    def _checkpoint(self, kwargs, step, **state):
+        """ Save simulation state every `checkpoint_every` steps. """
+        fname = kwargs.get('checkpoint', None)
+
+        if fname is None or step % kwargs.get('checkpoint_every', 100):
+            return
+
+        # Write to temporary file first to never corrupt checkpoint.
+        with self._timer('checkpoint'):
+            tmp = f'{fname}.tmp.npz'
+            writer = kwargs.get('writer', None)
+            calls = -1 if writer is None else writer._calls
+
+            np.savez(tmp, x=self._x / 1_000_000, guess=self._guess,
+                     options=self._options, writer_calls=calls,
+                     **self._equilibrium_state(), **state)
+            os.replace(tmp, fname)
+
+    @staticmethod
+    def _checkpoint_options(kwargs):
+        """ Options stored in checkpoints to restart with (JSON string).
+
+        NumPy values are stored as Python ones. Other options which
+        cannot be stored (writer, statistics...) are dropped, except
+        those defining time steps or nodes, which raise an error.
+        """
+        def builtin(value):
+            if isinstance(value, np.generic):
+                return value.item()
+
+            if isinstance(value, np.ndarray):
+                return value.tolist()
+
+            raise TypeError(f'{type(value).__name__} is not serializable')
+
+        options = {}
+
+        for key, value in kwargs.items():
+            if key == 'restart':
+                continue
+
+            try:
+                options[key] = json.loads(json.dumps(value, default=builtin))
+            except (TypeError, ValueError):
+                if key in ('nt', 'dt0', 'x', 'y', 't_out'):
+                    raise ValueError(f'Option `{key}` cannot be stored '
+                                     f'in checkpoint')
+
+        return json.dumps(options)
+
+    def resume(self, fname, T, **kwargs):
+        """ Restart simulation from checkpoint `fname`.
+
+        Temperature program `T` is not stored in checkpoints and must
+        be provided again; other options are restored from checkpoint
+        unless overridden in `kwargs`. A `writer` is rewound to the
+        checkpoint time, dropping snapshots written after it.
+        """
+        with np.load(fname) as data:
+            state = {k: data[k] for k in data.files}
+
+        options = json.loads(str(state.pop('options')))
+        options.update(kwargs, restart=state)
+
+        calls = int(state.pop('writer_calls', -1))
+
+        if options.get('writer', None) is not None:
+            options['writer'].rewind(float(state['t']),
+                                     None if calls < 0 else calls)
+
+        return self.solve_implicit(float(state['t_end']),
+                                   float(state['x_end']), state['u0'], T,
+                                   **options)
+
+    def _solve_adaptive(self, t_end, u0, **kwargs):
+        """ Implicit integration with step doubling error control.
+
+        Each step is compared against two steps of half size and it is
+        accepted if the scaled difference is below unity. Step is then
+        resized following the first order local error of the scheme.
+        """
+        rtol = kwargs.get('rtol', 1.0e-03)
+        atol = kwargs.get('atol', 1.0e-06)
+        dt_min = kwargs.get('dt_min', 1.0e-06)
+        dt_max = kwargs.get('dt_max', np.inf)
+
+        # Output times always include end time.
+        t_out = np.unique(np.append(kwargs.get('t_out', []), t_end))
+        u_out, x_out = [], []
+
+        dt = kwargs.get('dt0', self._dt)
+        remesh = kwargs.get('remesh', 0)
+        writer = kwargs.get('writer', None)
+        state = kwargs.get('restart', None)
+
+        if state is None:
+            t, u, n = 0.0, u0.copy(), 0
+            self._write(writer, t, u)
+        else:
+            t, u, n = float(state['t']), state['u'].copy(), int(state['n'])
+            dt = min(float(state['dt']), dt_max)
+
+        t_start = t
+
+        for t_next in t_out:
+            # Outputs before restart were already produced.
+            if t_next < t_start:
+                continue
+
+            while t < t_next:
+                last = dt >= t_next - t
+                h = t_next - t if last else dt
+
+                u_full = self._step(u, t, h, u0[0])
+                u_half = self._step(u, t, h / 2, u0[0])
+                u_half = self._step(u_half, t + h / 2, h / 2, u0[0])
+
+                scale = atol + rtol * np.abs(u_half)
+                err = np.max(np.abs(u_half - u_full) / scale)
+                factor = min(5.0, max(0.2, 0.9 / np.sqrt(max(err, 1.0e-10))))
+
+                if err <= 1:
+                    self._progress(kwargs, n, t, h)
+
+                    t, u, n = t_next if last else t + h, u_half, n + 1
+                    dt = max(dt, h * factor) if last else h * factor
+
+                    if remesh and not n % remesh:
+                        with self._timer('remesh'):
+                            u = self._remesh(u, **kwargs)
+
+                    self._write(writer, t, u, force=t == t_out[-1])
+                    self._checkpoint(kwargs, n, t=t, u=u, n=n, dt=dt,
+                                     **self._run)
+                else:
+                    dt = h * factor
+
+                dt = min(dt, dt_max)
+
+                if dt < dt_min:
+                    raise ValueError(f'Time step below minimum at {t} s')
+
+            # Requested profiles are kept only if not streamed.
+            if writer is None:
+                u_out.append(u.copy())
+                x_out.append(self._x.copy())
+            else:
+                self._write(writer, t, u, force=True)
+
+        self._t_out = t_out
+        self._u_out = np.array(u_out)
+        self._x_out = np.array(x_out)
+        self._nsteps = n
+
+        return u
+
+    @_instrumented
+    def solve_implicit(self, t_end, x_end, u0, T, **kwargs):
+        """ Simulate implicit problem with provided conditions.
+
+        By default integration is performed over `nt` fixed steps. With
+        `adaptive=True` step size is controlled by step doubling with
+        tolerances `rtol` and `atol`, starting from `dt0` and bounded
+        by `dt_min` and `dt_max`; profiles at requested times `t_out`
+        are then stored in attributes `_t_out`, `_x_out` and `_u_out`.
+
+        With `remesh=n` nodes are moved every `n` steps to follow the
+        phase front (see `_remesh`), with `remesh_weight` controlling
+        the share of nodes clustered at steep gradients.
+
+        Equilibrium can be solved only in cells which changed with
+        `dirty_tol` or decoupled from diffusion steps with `split_every`
+        and `split_tol` (see `_set_equilibrium`; also accepted by
+        `solve_explicit`), estimated error being then in `split_error`.
+
+        Profiles are streamed to disk if a `ProfileWriter` is provided
+        as `writer` (then `_u_out` and `_x_out` are left empty).
+
+        State is saved every `checkpoint_every` steps (default 100) to
+        file `checkpoint` (`npz` format) if provided, from which the
+        simulation can be restarted with `resume`.
+
+        Progress is printed every `ofreq` steps, unless `RunStats` are
+        provided as `stats`, which then collect timers and counters of
+        the run and report progress to their callback.
+        """
+        t_eval = self._build(t_end, x_end, u0, T, **kwargs)
+        state = kwargs.get('restart', None)
+
+        # Quantities required to restart from checkpoints.
+        adaptive = kwargs.get('adaptive', False)
+        self._run = dict(t_end=t_end, x_end=x_end, u0=u0,
+                         adaptive=adaptive)
+
+        if state is not None:
+            self._restore(state)
+
+        if kwargs.get('checkpoint', None) is not None:
+            self._options = self._checkpoint_options(kwargs)
+
+        if adaptive:
+            self._u = self._solve_adaptive(t_end, u0, **kwargs)
+            return self._finalize(**kwargs)
+
+        dt = self._dt
+        remesh = kwargs.get('remesh', 0)
+        writer = kwargs.get('writer', None)
+
+        if state is None:
+            k0, u = 0, u0.copy()
+            self._write(writer, 0.0, u)
+        else:
+            k0, u = int(state['k']), state['u'].copy()
+
+        for k in range(k0, len(t_eval)):
+            t = t_eval[k]
+
+            self._progress(kwargs, k, t)
+
+            u = self._step(u, t, dt, u0[0])
+
+            if remesh and k and not k % remesh:
+                with self._timer('remesh'):
+                    u = self._remesh(u, **kwargs)
+
+            self._write(writer, t + dt, u, force=k == len(t_eval) - 1)
+            self._checkpoint(kwargs, k + 1, t=t + dt, u=u, k=k + 1,
+                             **self._run)
 
         self._u = u
-        return self._plot_final_profile(u)
+        return self._finalize(**kwargs)
+
+    def _finalize(self, **kwargs):
+        """ Plot final profile unless `plot=False` (then return it). """
+        if not kwargs.get('plot', True):
+            return self._u
+
+        return self._plot_final_profile(self._u)
+
+
+class NitridingLayer(_NitridingModel):
+    """ Nitriding simulation with phase transformation (local equilibria).
+
+    Parameters
+    ----------
+    calculator : callable, optional
+        Replacement for `equilibrate_batch` with the same signature, such
+        as an `EquilibriumTable` or an `EquilibriumCache` instance.
+    params : dict, optional
+        Replacement of diffusion parameters (see `PARAMS`).
+    """
+    def _beta(self, u, t, T=None):
+        """ Return numerical scheme coefficient. """
+        return self._diffusivity(u, t, T=T) / self._dx2
+
+    def _face_coefficient(self, u, t):
+        """ Model coefficients on cell interfaces.
+
+        Diffusivity on faces is the harmonic mean of values at nodes;
+        divided by distance between nodes and by control volume of
+        inner nodes it provides the coefficients of "West" and "East"
+        neighbors in the balance of each inner node.
+        """
+        d = self._diffusivity(u, t)
+
+        with self._timer('coefficients'):
+            k = 2 * (d[:-1] * d[1:]) / (d[:-1] + d[1:]) / self._dxf
+            return k[:-1] / self._vol, k[1:] / self._vol
+
+    def _get_problem_bands(self, u, t):
+        """ Fill banded diffusion integration matrix in place.
+
+        Matrix is stored in the diagonal ordered form expected by
+        `scipy.linalg.solve_banded` with one upper and one lower band.
+        """
+        # Compute coefficients on interfaces of cells.
+        kw, ke = self._face_coefficient(u, t)
+
+        with self._timer('assembly'):
+            kw *= self._dt
+            ke *= self._dt
+            ab = self._ab
+
+            # Main diagonal of implicit problem with Dirichlet B.C.
+            ab[1, 0] = ab[1, -1] = 1.0
+            np.add(kw, ke, out=ab[1, 1:-1])
+            ab[1, 1:-1] += 1
+
+            # Upper diagonal starting with Dirichlet B.C.
+            ab[0, 1] = 0.0
+            np.negative(ke, out=ab[0, 2:])
+
+            # Lower diagonal ending with Dirichlet B.C.
+            ab[2, -2] = 0.0
+            np.negative(kw, out=ab[2, :-2])
+
+        return ab
+
+    def __call__(self, t, u):
+        """ Problem derivatives for mass fraction of nitrogen. """
+        # Allocate memory and set first B.C./derivative to zero.
+        udot = np.zeros_like(u)
+
+        # Compute coefficients on interfaces of cells.
+        kw, ke = self._face_coefficient(u, t)
+        
+        # Fluxes on "East" faces.
+        de_x_ue = ke * u[2:]
+
+        # Fluxes on "West" faces.
+        dw_x_uw = kw * u[:-2]
+
+        # Compute inner domain derivatives.
+        udot[1:-1] = de_x_ue - (kw + ke) * u[1:-1] + dw_x_uw
+
+        return udot
+
+    def jacobian(self, t, u):
+        """ Tridiagonal Jacobian of derivatives with frozen coefficients. """
+        from scipy import sparse
+
+        kw, ke = self._face_coefficient(u, t)
+
+        with self._timer('jacobian'):
+            # Inner domain diagonals, Dirichlet rows are kept null.
+            mm = np.hstack((0.0, -1 * (kw + ke), 0.0))
+            ke = np.hstack((0.0, ke))
+            kw = np.hstack((kw, 0.0))
+
+            return sparse.diags([kw, mm, ke], offsets=[-1, 0, 1],
+                                format='csc')
+
+    def _jacobian_banded(self, t, u):
+        """ Jacobian in packed banded format as required by LSODA. """
+        J = self.jacobian(t, u)
+        return np.vstack((np.hstack((0.0, J.diagonal(1))), J.diagonal(0),
+                          np.hstack((J.diagonal(-1), 0.0))))
+
+    def _set_mesh(self, x):
+        """ Store mesh quantities from node coordinates [m]. """
+        x = np.asarray(x, dtype=float)
+
+        if np.any(np.diff(x) <= 0):
+            raise ValueError('Nodes must be strictly increasing')
+
+        # Distances between nodes and control volumes of inner nodes.
+        self._dxf = np.diff(x)
+        self._vol = 0.5 * (self._dxf[:-1] + self._dxf[1:])
+        self._dx2 = np.gradient(x) ** 2
+
+        # Transform values for post-processing.
+        self._x = x * 1_000_000
+
+    def _remesh(self, u, **kwargs):
+        """ Move nodes to resolve the phase front, conserving nitrogen.
+
+        Nodes are redistributed so that each interval holds the same
+        integral of a monitor function, which grows with the gradients
+        of ferrite fraction and (normalized) nitrogen content. Thus
+        nodes cluster at the moving interface and near the surfaces and
+        are coarsened elsewhere, while the number of nodes is kept.
+        Profile is remapped by integrating it over the control volumes,
+        so that total nitrogen is conserved.
+        """
+        from scipy import interpolate
+
+        x = self._x / 1_000_000
+        v = self._guess[:, 0]
+        L = x[-1] - x[0]
+
+        # Monitor function over intervals, smoothed to grade sizes.
+        du = np.abs(np.diff(u)) / max(np.ptp(u), np.finfo(float).tiny)
+        rho = 1 + kwargs.get('remesh_weight', 0.3) * L *\
+            (np.abs(np.diff(v)) + du) / self._dxf
+
+        for _ in range(kwargs.get('remesh_smooth', 20)):
+            rho[1:-1] = 0.25 * (rho[:-2] + 2 * rho[1:-1] + rho[2:])
+
+        # Equidistribute monitor function over intervals.
+        c = np.hstack((0.0, np.cumsum(rho * self._dxf)))
+        x_new = np.interp(np.linspace(0.0, c[-1], len(x)), c, x)
+
+        # Conservative remap over control volumes.
+        f_old = np.hstack((x[0], 0.5 * (x[:-1] + x[1:]), x[-1]))
+        f_new = np.hstack((x[0], 0.5 * (x_new[:-1] + x_new[1:]), x[-1]))
+        m_old = np.hstack((0.0, np.cumsum(u * np.diff(f_old))))
+        m_new = interpolate.PchipInterpolator(f_old, m_old)(f_new)
+        u_new = np.diff(m_new) / np.diff(f_new)
+
+        # Transfer equilibrium guess (only used as starting point).
+        self._guess = np.column_stack([np.interp(x_new, x, g)
+                                       for g in self._guess.T])
+
+        # Frozen equilibrium (split-step mode) refers to old nodes.
+        self._u_eq = None
+
+        self._set_mesh(x_new)
+        return u_new
+
+    def _build(self, t_end, x_end, u0, T, **kwargs):
+        """ Prepare problem internals for simulation. """
+        # Discretize time, retrieve steps.
+        nt = kwargs.get('nt', int(t_end) + 1)
+        t_eval, self._dt = np.linspace(0, t_end, nt, retstep=True)
+
+        # Discretize space (user provided or graded nodes).
+        x = kwargs.get('x', None)
+
+        if x is None:
+            x = graded_mesh(x_end, len(u0), kwargs.get('grading', 1.0))
+
+        if len(x) != len(u0):
+            raise ValueError('Number of nodes must match `u0`')
+
+        self._set_mesh(x)
+
+        # Storage for banded implicit problem matrix.
+        self._ab = np.zeros((3, len(u0)))
+
+        # Store values for post-processing.
+        self._temperature = T
+        self._T_end = T(t_end)
+
+        # Compute initial guess.
+        self._guess = self.fraction_alpha(T(0), u0, None, self._calculator)
+        self._set_equilibrium(kwargs)
+        
+        return t_eval
+
+    def _restore(self, state):
+        """ Mesh and equilibrium state from checkpoint `state`. """
+        self._set_mesh(state['x'])
+        self._ab = np.zeros((3, len(state['x'])))
+        super()._restore(state)
+
+    def _write(self, writer, t, u, force=False):
+        """ Append snapshot to `writer` at its cadence (if any). """
+        if writer is None or not writer.due(t, force):
+            return
+
+        d = self._snapshot_diffusivity(u, t)
+
+        with self._timer('write'):
+            writer.write(t, x=self._x, u=u, alpha=self._guess[:, 0],
+                         diffusivity=d)
+
+    def _plot_final_profile(self, u):
+        """ Display integration results (profiles). """
+        from matplotlib import pyplot as plt
+
+        v = self.fraction_alpha(self._T_end, u, self._guess,
+                                self._calculator)[:, 0]
+        beta = self._beta(u, None, T=self._T_end)
+
+        plt.close('all')
+        plt.style.use('seaborn-whitegrid')
+        fig = plt.figure(figsize=(12, 9))
+
+        ax = plt.subplot(311)
+        plt.plot(self._x, 100 * u)
+        plt.ylabel("Nitrogen content [%wt]")
+
+        ax = plt.subplot(312, sharex=ax)
+        plt.plot(self._x, 100 * v)
+        plt.ylabel("Ferrite fraction [%]")
+
+        ax = plt.subplot(313, sharex=ax)
+        plt.plot(self._x, beta)
+        plt.ylabel("Problem constant [1/s]")
+        plt.xlabel("Position [µm]")
+
+        plt.tight_layout()
+
+        return fig
+
+    @_instrumented
+    def solve_explicit(self, t_end, x_end, u0, T, **kwargs):
+        """ Simulate explicit problem with provided conditions.
+
+        Integration method is selected with `method` keyword (default
+        `RK23`). For stiff methods `BDF`, `Radau` and `LSODA` the banded
+        Jacobian of the problem is supplied to the integrator and steps
+        are not limited unless `max_step` is provided.
+
+        A figure with final profiles is returned, or the final profile
+        itself if `plot=False` is provided (same for `solve_implicit`).
+
+        If a `ProfileWriter` is provided as `writer`, profiles at the
+        `nt` evaluation times are streamed to it and only the final
+        state is kept in `solution`.
+        """
+        from scipy import integrate
+
+        t_eval = self._build(t_end, x_end, u0, T, **kwargs)
+        method = kwargs.get('method', 'RK23')
+        stiff = method in ('BDF', 'Radau', 'LSODA')
+
+        opts = dict(method=method, t_eval=t_eval, vectorized=False,
+                    max_step=kwargs.get('max_step', np.inf if stiff else 1.0))
+
+        if method == 'LSODA':
+            opts.update(jac=self._jacobian_banded, lband=1, uband=1)
+        elif stiff:
+            opts.update(jac=self.jacobian)
+
+        writer = kwargs.get('writer', None)
+
+        if writer is None:
+            self._sol = integrate.solve_ivp(self, [0, t_end], u0, **opts)
+        else:
+            self._sol = self._solve_streaming(u0, writer, **opts)
+
+        if not self._sol.success:
+            raise ValueError('Last simulation failed...')
+
+        self._u = self._sol.y.T[-1]
+        return self._finalize(**kwargs)
+
+    def _solve_streaming(self, u0, writer, method, t_eval, **opts):
+        """ Integrate step by step writing profiles at `t_eval`.
+
+        Only the final state is kept in the returned solution, profiles
+        at evaluation times are interpolated from dense output of steps
+        and handed to `writer` (at its cadence).
+        """
+        from scipy import integrate
+        from scipy.optimize import OptimizeResult
+
+        opts.pop('vectorized')
+        solver = getattr(integrate, method)(self, 0, u0, t_eval[-1],
+                                            **opts)
+        k = 0
+
+        while solver.status == 'running':
+            message = solver.step()
+            dense = None
+
+            while k < len(t_eval) and t_eval[k] <= solver.t:
+                if dense is None:
+                    dense = solver.dense_output()
+
+                self._write(writer, t_eval[k], dense(t_eval[k]),
+                            force=k == len(t_eval) - 1)
+                k += 1
+
+        return OptimizeResult(t=np.array([solver.t]), y=solver.y[:, None],
+                              nfev=solver.nfev, njev=solver.njev,
+                              nlu=solver.nlu, status=solver.status,
+                              message=message,
+                              success=solver.status == 'finished')
+
+    def _step(self, u, t, dt, u_surface):
+        """ Advance profile by a single implicit step of size `dt`. """
+        from scipy import linalg
+
+        u = u.copy()
+        u[0] = u[-1] = u_surface
+
+        self._dt = dt
+        ab = self._get_problem_bands(u, t)
+
+        with self._timer('solve'):
+            return linalg.solve_banded((1, 1), ab, u, overwrite_ab=True,
+                                       overwrite_b=True, check_finite=False)
 
     @property
     def solution(self):
@@ -470,27 +2380,738 @@ class NitridingLayer:
         if not hasattr(self, '_sol'):
             raise ValueError('First call `solve_explicit`...')
         return self._sol
-    
-    
+
+
+class NitridingSection(_NitridingModel):
+    """ Nitriding of 2D (or axisymmetric) sections with local equilibria.
+
+    Domain is the rectangle `[0, x_end] x [0, y_end]` discretized by
+    node-centered finite volumes over a tensor grid of the shape of the
+    initial field `u0`. Diffusivities follow the same models as in 1D
+    (`_coef_alpha`, `_coef_gamma` and `_coef_mixture`) with equilibrium
+    computed for all nodes in a single batch. Nodes on sides listed in
+    `exposed` (any of `west`, `east`, `south` and `north`, or a boolean
+    mask of nodes) are held at their initial content, other sides are
+    impermeable (symmetry planes).
+
+    With `axisymmetric=True` coordinate `x` is the radius and `y` the
+    axial position, so that `exposed=('east', 'south')` represents the
+    edge of a cylinder.
+
+    Parameters
+    ----------
+    calculator : callable, optional
+        Replacement for `equilibrate_batch` with the same signature.
+    axisymmetric : bool, optional
+        Use cylindrical coordinates (default planar).
+    params : dict, optional
+        Replacement of diffusion parameters (see `PARAMS`).
+    """
+    SIDES = dict(west=(0, 0), east=(0, -1), south=(1, 0), north=(1, -1))
+
+    def __init__(self, calculator=None, axisymmetric=False, params=None):
+        super().__init__(calculator=calculator, params=params)
+        self._axisymmetric = axisymmetric
+
+    @staticmethod
+    def _control_volumes(x, axisymmetric=False):
+        """ Control volume extent of nodes and face areas along `x`. """
+        f = np.hstack((x[0], 0.5 * (x[:-1] + x[1:]), x[-1]))
+
+        if axisymmetric:
+            return 0.5 * np.diff(f ** 2), f[1:-1]
+
+        return np.diff(f), np.ones(len(x) - 1)
+
+    def _set_mesh(self, x, y, exposed):
+        """ Store mesh quantities and sparsity pattern of free nodes. """
+        from scipy import sparse
+
+        x, y = (np.asarray(v, dtype=float) for v in (x, y))
+
+        if np.any(np.diff(x) <= 0) or np.any(np.diff(y) <= 0):
+            raise ValueError('Nodes must be strictly increasing')
+
+        nx, ny = self._shape = len(x), len(y)
+        idx = np.arange(nx * ny).reshape(nx, ny)
+
+        # Control volumes and faces of nodes along each direction.
+        vx, ax = self._control_volumes(x, self._axisymmetric)
+        vy, ay = self._control_volumes(y)
+        self._vol = np.outer(vx, vy).ravel()
+
+        # Nodes on both sides of faces and geometric factors (area over
+        # distance between nodes) of faces normal to `x` then `y`.
+        self._p = np.hstack((idx[:-1, :].ravel(), idx[:, :-1].ravel()))
+        self._q = np.hstack((idx[1:, :].ravel(), idx[:, 1:].ravel()))
+        self._g = np.hstack((np.outer(ax / np.diff(x), vy).ravel(),
+                             np.outer(vx, 1 / np.diff(y)).ravel()))
+
+        # Nodes held at surface content.
+        if isinstance(exposed, (str, tuple, list)) and \
+                all(isinstance(side, str) for side in exposed):
+            fixed = np.zeros((nx, ny), dtype=bool)
+
+            for side in ([exposed] if isinstance(exposed, str) else exposed):
+                axis, k = self.SIDES[side]
+                fixed[(slice(None),) * axis + (k,)] = True
+        else:
+            fixed = np.asarray(exposed, dtype=bool).reshape(nx, ny)
+
+        self._fixed = fixed.ravel()
+        self._free = np.flatnonzero(~self._fixed)
+        nf = len(self._free)
+
+        pos = np.full(nx * ny, -1)
+        pos[self._free] = np.arange(nf)
+
+        # Faces coupling two free nodes enter the matrix, those between
+        # free and fixed nodes its right-hand side.
+        fp, fq = ~self._fixed[self._p], ~self._fixed[self._q]
+        self._ff = np.flatnonzero(fp & fq)
+        self._fd = np.flatnonzero(fp ^ fq)
+        self._fd_row = pos[np.where(fp, self._p, self._q)[self._fd]]
+        self._fd_col = np.where(fp, self._q, self._p)[self._fd]
+
+        # Symmetric matrix pattern (diagonal first) and permutation from
+        # entries in this order to storage of compressed matrix.
+        rows = np.hstack((np.arange(nf), pos[self._p[self._ff]],
+                          pos[self._q[self._ff]]))
+        cols = np.hstack((np.arange(nf), pos[self._q[self._ff]],
+                          pos[self._p[self._ff]]))
+        order = np.arange(1, len(rows) + 1, dtype=float)
+
+        self._A = sparse.csc_matrix((order, (rows, cols)), shape=(nf, nf))
+        self._perm = self._A.data.astype(int) - 1
+
+        # Transform values for post-processing.
+        self._x = x * 1_000_000
+        self._y = y * 1_000_000
+
+    def _face_conductance(self, u, t):
+        """ Conductance of faces (harmonic mean diffusivity).
+
+        Faces are processed in chunks of `chunk` entries, in parallel
+        threads if `workers` is larger than one.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        d = self._diffusivity(u, t)
+
+        with self._timer('coefficients'):
+            k = np.empty_like(self._g)
+
+            def fill(s):
+                dp, dq = d[self._p[s]], d[self._q[s]]
+                np.multiply(2 * dp * dq / (dp + dq), self._g[s], out=k[s])
+
+            chunks = [slice(a, a + self._chunk)
+                      for a in range(0, len(k), self._chunk)]
+
+            if self._workers > 1 and len(chunks) > 1:
+                with ThreadPoolExecutor(self._workers) as pool:
+                    list(pool.map(fill, chunks))
+            else:
+                for s in chunks:
+                    fill(s)
+
+        return k
+
+    def _get_problem_matrix(self, u, t):
+        """ Implicit problem matrix and right-hand side of free nodes. """
+        k = self._face_conductance(u, t)
+
+        with self._timer('assembly'):
+            n = len(u)
+            m = self._vol / self._dt
+
+            # Diagonal collects all faces, including those to fixed nodes.
+            diag = m + np.bincount(self._p, k, n) + np.bincount(self._q, k, n)
+            off = -k[self._ff]
+
+            self._A.data[:] = np.hstack((diag[self._free], off,
+                                         off))[self._perm]
+
+            b = m[self._free] * u[self._free]
+            b += np.bincount(self._fd_row, k[self._fd] * u[self._fd_col],
+                             len(self._free))
+
+        return self._A, b
+
+    def _linear_solve(self, A, b, x0):
+        """ Solve symmetric problem with direct or iterative method. """
+        from scipy import sparse
+        from scipy.sparse import linalg
+
+        if self._solver == 'direct':
+            return linalg.spsolve(A, b, permc_spec='MMD_AT_PLUS_A')
+
+        # Conjugate gradients with Jacobi preconditioner.
+        M = sparse.diags(1 / A.diagonal())
+        count = lambda xk: RunStats.count('cg_iterations')
+        x, info = linalg.cg(A, b, x0=x0, rtol=self._rtol, M=M,
+                            callback=count)
+
+        if info:
+            raise ValueError(f'Linear solver did not converge ({info})')
+
+        return x
+
+    def _build(self, t_end, x_end, u0, T, **kwargs):
+        """ Prepare problem internals for simulation.
+
+        Besides options of `solve_implicit` (remeshing
+        excepted), accepts domain height `y_end` (default `x_end`), node
+        coordinates `x` and `y`, `exposed` sides, `linear_solver` (one
+        of `direct`, `cg` or `auto`, which selects the former below
+        `direct_limit` nodes), `rtol_linear` for `cg`, and number of
+        threads `workers` for assembly of chunks of `chunk` faces.
+        """
+        if kwargs.get('remesh', 0):
+            raise ValueError('Remeshing is only available in 1D')
+
+        u0 = np.asarray(u0, dtype=float)
+
+        if u0.ndim != 2:
+            raise ValueError('Initial field `u0` must be 2D')
+
+        # Discretize time, retrieve steps.
+        nt = kwargs.get('nt', int(t_end) + 1)
+        t_eval, self._dt = np.linspace(0, t_end, nt, retstep=True)
+
+        # Discretize space (user provided or graded nodes).
+        grading = kwargs.get('grading', 1.0)
+        y_end = kwargs.get('y_end', x_end)
+        x = kwargs.get('x', None)
+        y = kwargs.get('y', None)
+        x = graded_mesh(x_end, u0.shape[0], grading) if x is None else x
+        y = graded_mesh(y_end, u0.shape[1], grading) if y is None else y
+
+        if (len(x), len(y)) != u0.shape:
+            raise ValueError('Number of nodes must match `u0`')
+
+        default = ('east', 'south') if self._axisymmetric else \
+            ('west', 'south')
+        self._set_mesh(x, y, kwargs.get('exposed', default))
+        self._u_fixed = u0.ravel()[self._fixed]
+
+        # Linear solver and parallel assembly options.
+        self._solver = kwargs.get('linear_solver', 'auto')
+        self._rtol = kwargs.get('rtol_linear', 1.0e-08)
+        self._workers = kwargs.get('workers', 1)
+        self._chunk = kwargs.get('chunk', 100_000)
+
+        if self._solver == 'auto':
+            self._solver = 'direct' if u0.size <= \
+                kwargs.get('direct_limit', 10_000) else 'cg'
+
+        # Store values for post-processing.
+        self._temperature = T
+        self._T_end = T(t_end)
+
+        # Compute initial guess.
+        self._guess = self.fraction_alpha(T(0), u0.ravel(), None,
+                                          self._calculator)
+        self._set_equilibrium(kwargs)
+
+        return t_eval
+
+    def _step(self, u, t, dt, u_surface=None):
+        """ Advance field by a single implicit step of size `dt`.
+
+        Content of exposed nodes is that of the initial field, thus
+        `u_surface` (used in 1D) is ignored.
+        """
+        u = np.array(u, dtype=float).ravel()
+        u[self._fixed] = self._u_fixed
+
+        self._dt = dt
+        A, b = self._get_problem_matrix(u, t)
+
+        with self._timer('solve'):
+            u[self._free] = self._linear_solve(A, b, u[self._free])
+
+        return u.reshape(self._shape)
+
+    def _write(self, writer, t, u, force=False):
+        """ Append snapshot to `writer` at its cadence (if any). """
+        if writer is None or not writer.due(t, force):
+            return
+
+        d = self._snapshot_diffusivity(u.ravel(), t)
+
+        with self._timer('write'):
+            writer.write(t, x=self._x, y=self._y, u=u,
+                         alpha=self._guess[:, 0].reshape(self._shape),
+                         diffusivity=d.reshape(self._shape))
+
+    def _plot_final_profile(self, u):
+        """ Display integration results (fields). """
+        from matplotlib import pyplot as plt
+
+        v = self.fraction_alpha(self._T_end, u.ravel(), self._guess,
+                                self._calculator)[:, 0]
+
+        plt.close('all')
+        fig, ax = plt.subplots(1, 2, figsize=(12, 5), sharey=True)
+
+        for a, z, label in zip(ax, (100 * u, 100 * v.reshape(self._shape)),
+                               ("Nitrogen content [%wt]",
+                                "Ferrite fraction [%]")):
+            mesh = a.pcolormesh(self._x, self._y, z.T, shading='gouraud')
+            fig.colorbar(mesh, ax=a, label=label)
+            a.set_xlabel(f"{'Radius' if self._axisymmetric else 'Position'}"
+                         " [µm]")
+            a.set_aspect('equal')
+
+        ax[0].set_ylabel("Position [µm]")
+        plt.tight_layout()
+
+        return fig
+
+
+def _temperature_program(T):
+    """ Callable temperature program from scenario specification. """
+    if callable(T):
+        return T
+
+    if np.ndim(T) == 0:
+        return lambda t: float(T)
+
+    # Piecewise linear program given as (times, temperatures).
+    times, temps = np.asarray(T, dtype=float)
+    return lambda t: np.interp(t, times, temps)
+
+
+def _run_scenario(scenario, method, kwargs, calculator=None):
+    """ Simulate a single campaign scenario (in worker process). """
+    model = NitridingLayer(calculator, scenario.get('params', None))
+    solve = getattr(model, f'solve_{method}')
+
+    T = _temperature_program(scenario['T'])
+    u0 = np.array(scenario['u0'], dtype=float)
+    u = solve(scenario['t_end'], scenario['x_end'], u0, T, plot=False,
+              **kwargs)
+
+    v = model.fraction_alpha(model._T_end, u, model._guess,
+                             model._calculator)[:, 0]
+
+    return model._x, u, v, model._T_end
+
+
+def campaign_grid(**axes):
+    """ List of scenarios from all combinations of provided values.
+
+    Example
+    -------
+    campaign_grid(T=[893.0, 943.0], u0=[u0], t_end=[60.0], x_end=[3e-4])
+    """
+    keys = list(axes.keys())
+    return [dict(zip(keys, values)) for values in product(*axes.values())]
+
+
+def run_campaign(scenarios, method='implicit', max_workers=None, **kwargs):
+    """ Simulate nitriding scenarios in parallel processes.
+
+    Each scenario is a dictionary with keys `T`, `u0`, `t_end` and
+    `x_end` (and optionally diffusion `params`). Temperature `T` can
+    be a constant, a pair of arrays of times and temperatures
+    (interpolated linearly) or a picklable callable of time. Extra
+    keyword arguments are forwarded to the solver selected by `method`
+    (`implicit` or `explicit`).
+
+    Equilibrium solvers are constructed once at first use in each
+    worker process, then reused for all of its scenarios.
+
+    Returns
+    -------
+    numpy.ndarray
+        Structured array with one record per scenario holding `t_end`,
+        `x_end`, `T_end` and final profiles of position `x` [µm],
+        mass fraction of nitrogen `u` and ferrite fraction `alpha`.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    sizes = {len(scenario['u0']) for scenario in scenarios}
+
+    if len(sizes) != 1:
+        raise ValueError('All scenarios must have the same number of cells')
+
+    nx = sizes.pop()
+    dtype = [('t_end', 'f8'), ('x_end', 'f8'), ('T_end', 'f8'),
+             ('x', 'f8', (nx,)), ('u', 'f8', (nx,)), ('alpha', 'f8', (nx,))]
+    results = np.zeros(len(scenarios), dtype=dtype)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        runs = pool.map(_run_scenario, scenarios, repeat(method),
+                        repeat(kwargs))
+
+        for k, (scenario, run) in enumerate(zip(scenarios, runs)):
+            results[k]['t_end'] = scenario['t_end']
+            results[k]['x_end'] = scenario['x_end']
+            results[k]['x'], results[k]['u'], results[k]['alpha'], \
+                results[k]['T_end'] = run
+
+    return results
+
+
+# Calculator shared by forward simulations of a worker process.
+_FIT_WORKER = {}
+
+
+def _fit_worker_init(calculator):
+    """ Store equilibrium calculator of `DiffusivityFit` in worker. """
+    _FIT_WORKER['calculator'] = calculator
+
+
+def _fit_forward(scenario, method, kwargs):
+    """ Final nitrogen content at measured depths of an experiment. """
+    x, u, _, _ = _run_scenario(scenario, method, kwargs,
+                               _FIT_WORKER.get('calculator', None))
+    return np.interp(1_000_000 * np.asarray(scenario['depth']), x, u)
+
+
+class DiffusivityFit:
+    """ Calibration of diffusion parameters against measured profiles.
+
+    Each experiment is a scenario as in `run_campaign` (keys `T`, `u0`,
+    `t_end` and `x_end`) with measured depths `depth` [m] and nitrogen
+    mass fractions `w` of the final profile (and optionally their
+    standard deviation `sigma`, by default the largest measured value,
+    so that residuals are relative). Parameters listed in `fit` (keys of
+    `NitridingLayer.PARAMS`) are adjusted by least squares over the
+    logarithm of pre-exponential factors and activation energies in
+    units of 10 kJ/mol, other parameters being those of `params`.
+    Notice that factors and energies of a phase can only be told apart
+    with experiments at different temperatures.
+
+    Forward simulations run in `max_workers` processes, with phase
+    equilibria provided by `calculator`, by default an `EquilibriumTable`
+    spanning temperatures and contents of experiments (built once and
+    handed once to each worker). Results are cached by parameters in a
+    LRU cache of `maxsize` entries, so that repeated candidates are not
+    simulated again. Other keyword arguments are forwarded to the solver
+    selected by `method`.
+    """
+    def __init__(self, experiments, fit=('d0_alpha', 'ea_alpha', 'd0_gamma',
+                                         'ea_gamma'),
+                 params=None, method='implicit', calculator=None,
+                 max_workers=None, maxsize=1000, **kwargs):
+        self._experiments = [dict(e) for e in experiments]
+        self._fit = tuple(fit)
+        self._params = {**NitridingLayer.PARAMS, **(params or {})}
+        self._method = method
+        self._kwargs = kwargs
+        self._max_workers = max_workers
+        self._maxsize = maxsize
+        self._cache = OrderedDict()
+        self._pool = None
+        self.hits = 0
+        self.misses = 0
+
+        if calculator is None:
+            calculator = self._surrogate(self._experiments)
+
+        self._calculator = calculator
+
+    @staticmethod
+    def _surrogate(experiments, nw=201, tol=1.0e-03):
+        """ Equilibrium table spanning conditions of experiments. """
+        temps, w_max = [], 0.0
+
+        for e in experiments:
+            program = _temperature_program(e['T'])
+            temps += [program(t) for t in np.linspace(0, e['t_end'], 51)]
+            w_max = max(w_max, np.max(e['u0']))
+
+        temps = np.unique(np.round(temps, 1))
+        T = np.unique(np.hstack((temps, temps[0] - 1.0, temps[-1] + 1.0)))
+        w = np.linspace(0.0, 1.05 * w_max, nw)
+
+        return EquilibriumTable(T, w).refine(tol=tol)
+
+    def _key(self, params):
+        """ Hashable cache key of parameters. """
+        return tuple((k, float(f'{v:.12g}') if k != 'mixture' else v)
+                     for k, v in sorted(params.items()))
+
+    def _map(self, scenarios):
+        """ Forward simulations of scenarios (in parallel processes). """
+        from concurrent.futures import ProcessPoolExecutor
+
+        args = (scenarios, repeat(self._method), repeat(self._kwargs))
+
+        if self._max_workers == 1:
+            _fit_worker_init(self._calculator)
+            return list(map(_fit_forward, *args))
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._max_workers, initializer=_fit_worker_init,
+                initargs=(self._calculator,))
+
+        return list(self._pool.map(_fit_forward, *args))
+
+    def simulate(self, *candidates):
+        """ Predicted contents at measured depths for parameter sets.
+
+        All candidates missing from cache are simulated at once, so that
+        they are spread over worker processes.
+        """
+        candidates = [{**self._params, **p} for p in candidates]
+        keys = [self._key(p) for p in candidates]
+        missing = [k for k in dict.fromkeys(keys) if k not in self._cache]
+
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+
+        scenarios = [dict(e, params=dict(k)) for k in missing
+                     for e in self._experiments]
+        results = self._map(scenarios) if scenarios else []
+        n = len(self._experiments)
+
+        for k, key in enumerate(missing):
+            self._cache[key] = results[k * n:(k + 1) * n]
+
+        for key in keys:
+            self._cache.move_to_end(key)
+
+        predictions = [self._cache[key] for key in keys]
+
+        while len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
+
+        return predictions
+
+    def _weighted(self, prediction):
+        """ Weighted residuals of all measurements for `prediction`. """
+        return np.hstack([(p - e['w']) / e.get('sigma', np.abs(e['w']).max())
+                          for p, e in zip(prediction, self._experiments)])
+
+    def residuals(self, params):
+        """ Weighted residuals of all measurements for `params`. """
+        return self._weighted(self.simulate(params)[0])
+
+    def _to_z(self, params):
+        """ Optimization variables from parameters. """
+        return np.array([np.log(params[k]) if k.startswith('d0')
+                         else params[k] / 10_000 for k in self._fit])
+
+    def _from_z(self, z, params):
+        """ Parameters from optimization variables. """
+        fitted = {k: float(np.exp(v)) if k.startswith('d0')
+                  else float(v * 10_000) for k, v in zip(self._fit, z)}
+        return {**params, **fitted}
+
+    def fit(self, mixtures=None, diff_step=1.0e-03, **kwargs):
+        """ Fit parameters for each of `mixtures` models, keeping best.
+
+        Minimization is performed by `scipy.optimize.least_squares` (to
+        which `kwargs` are forwarded, by default with `x_scale='jac'`)
+        starting from current parameters, with Jacobians approximated
+        by forward differences of step `diff_step` whose simulations are
+        run together. Returned result holds fitted `params` and results
+        of all models in `models`.
+        """
+        from scipy.optimize import least_squares
+
+        kwargs.setdefault('x_scale', 'jac')
+
+        mixtures = (self._params['mixture'],) if mixtures is None \
+            else mixtures
+        lower = [np.log(1.0e-12) if k.startswith('d0') else 1.0
+                 for k in self._fit]
+        upper = [np.log(1.0e-02) if k.startswith('d0') else 50.0
+                 for k in self._fit]
+        models = {}
+
+        for mixture in mixtures:
+            base = dict(self._params, mixture=mixture)
+            step = diff_step * np.eye(len(self._fit))
+
+            def fun(z):
+                return self.residuals(self._from_z(z, base))
+
+            def jac(z):
+                # Perturbed candidates are simulated in a single batch.
+                runs = self.simulate(*(self._from_z(z + h, base)
+                                       for h in (0 * step[0], *step)))
+                r = [self._weighted(run) for run in runs]
+                return np.column_stack([(rk - r[0]) / diff_step
+                                        for rk in r[1:]])
+
+            res = least_squares(fun, self._to_z(base), jac=jac,
+                                bounds=(lower, upper), **kwargs)
+            res.params = self._from_z(res.x, base)
+            models[mixture] = res
+
+        best = min(models.values(), key=lambda res: res.cost)
+        best.models = models
+        self._params = best.params
+
+        return best
+
+    @property
+    def params(self):
+        """ Current (last fitted) parameters. """
+        return dict(self._params)
+
+    @property
+    def info(self):
+        """ Cache statistics: hits, misses, size and hit rate. """
+        total = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, size=len(self._cache),
+                    hit_rate=self.hits / total if total else 0.0)
+
+    def close(self):
+        """ Release worker processes. """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class OpEnCalculator:
+    """ Equilibrium calculator served by OpEn TCP optimizer `ceqsier`.
+
+    Attaches to a server already listening at `ip:port` or, if none is
+    found and the `path` of the optimizer built by `make_optimizer` is
+    given (e.g. `python_build/ceqsier`), starts it; a server started
+    here is killed by `close`. As the TCP interface serves a single
+    request per connection, the points of a query are sent as parallel
+    requests from a pool of `workers` threads. Points which are not
+    solved by OpEn (all points of a query if the server is down) are
+    solved by `fallback` (default `CE`, i.e. Ipopt). For skipping
+    repeated states combine it with `EquilibriumCache`.
+    """
+    def __init__(self, path=None, ip='127.0.0.1', port=8333, workers=4,
+                 fallback=None):
+        from concurrent.futures import ThreadPoolExecutor
+        import opengen as og
+
+        self._manager = og.tcp.OptimizerTcpManager(path, ip, port)\
+            if path is not None else og.tcp.OptimizerTcpManager(ip=ip,
+                                                                port=port)
+        self._address = ip, port
+        self._started = False
+        self._alive = True
+
+        if not self._is_running(ip, port):
+            if path is None:
+                raise ValueError(f'No optimizer running at {ip}:{port}')
+
+            self._manager.start()
+            self._started = True
+
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._fallback = CE if fallback is None else fallback
+        self.fallbacks = 0
+
+    @staticmethod
+    def _is_running(ip, port):
+        """ Check whether a server accepts connections. """
+        import socket
+
+        try:
+            with socket.create_connection((ip, port), timeout=1.0):
+                return True
+        except OSError:
+            return False
+
+    def _solve(self, p, guess):
+        """ Solve a single point, returning None on failure.
+
+        Once a connection fails (server is down) remaining points of
+        the query are not sent, as each call retries for seconds.
+        """
+        if not self._alive:
+            return None
+
+        try:
+            response = self._manager.call(p, initial_guess=guess)
+        except OSError:
+            self._alive = False
+            return None
+        except ValueError:
+            return None
+
+        if not response.is_ok():
+            return None
+
+        status = response.get()
+
+        if status.exit_status != 'Converged':
+            return None
+
+        return status.solution
+
+    def __call__(self, T, w, guess=None):
+        """ Equilibrium [phi_alpha, phi_gamma, x_alpha, x_gamma] of arrays. """
+        T, w = np.broadcast_arrays(np.asarray(T, dtype=float),
+                                   np.atleast_1d(np.asarray(w, dtype=float)))
+        T, w = T.ravel(), w.ravel()
+        x0 = mass_to_mole_fraction(w)
+
+        # Same default starting point as `ce`.
+        if guess is None:
+            guess = HULL(T, w)
+
+        # Whole query is solved by fallback if server is down.
+        self._alive = self._is_running(*self._address)
+
+        params = np.column_stack((T, x0)).tolist()
+        runs = self._pool.map(self._solve, params, np.asarray(guess).tolist())
+
+        sol = np.empty((len(w), 4))
+
+        for k, xk in enumerate(runs):
+            if xk is None:
+                self.fallbacks += 1
+                xk = self._fallback(T[k], w[k], guess=guess[k])[0]['x']
+                xk = xk.full().ravel()
+
+            sol[k] = xk
+
+        return sol
+
+    def close(self):
+        """ Release worker threads and kill server if started here. """
+        self._pool.shutdown()
+
+        if self._started:
+            self._manager.kill()
+            self._started = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 def make_optimizer():
     # https://alphaville.github.io/optimization-engine/docs/python-interface.html
     # https://alphaville.github.io/optimization-engine/docs/python-tcp-ip
+    import opengen as og
+
     x, p, g, f = get_symbols()
 
     # from IPython import embed; embed(colors="Linux")
     
     set_c = og.constraints.Zero()
     
-    rect = og.constraints.Rectangle(xmin=[0, 0, 0, 0], 
+    # Compositions are kept positive to keep logarithms defined.
+    rect = og.constraints.Rectangle(xmin=[0, 0, 1.0e-12, 1.0e-12], 
                                     xmax=[1, 1, 1, 1])
     
-            # .with_penalty_constraints(g)  \
-    # problem = og.builder.Problem(x, p, f)          \
-    #     .with_aug_lagrangian_constraints(g, set_c) \
-    #     .with_constraints(rect)
-    problem = og.builder.Problem(x, p, f)
-        # .with_constraints(rect)
-
+    problem = og.builder.Problem(x, p, f)          \
+        .with_aug_lagrangian_constraints(g, set_c) \
+        .with_constraints(rect)
 
     meta = og.config.OptimizerMeta()         \
         .with_version("0.1.0")               \